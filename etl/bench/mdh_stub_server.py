@@ -0,0 +1,118 @@
+"""
+Local stand-in for the MDH API, serving synthetic payloads for every dataset in the registry
+and the location codes file. Point the ETL at it with MDH_API_BASE_URL=<printed url>.
+
+    python -m etl.bench.mdh_stub_server --records 100000 --duplicate-ratio 0.1
+"""
+import argparse
+import gzip
+import json
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+from etl.bench.synthetic_payloads import encode_payload, location_codes
+from etl.src.datasets import DATASETS
+from etl.src.datasets.mdh_datasets import MDH_API_BASE_URL
+
+LOCATION_CODES_PATH = "/v1/mdhvessel/reference/locations/filetype/json"
+LOCATION_CODES_FILE_PATH = "/files/location_codes.json"
+
+
+def dataset_routes():
+    """Regex of each dataset's endpoint path, derived from the registry's endpoint templates."""
+    routes = {}
+    for name, spec in DATASETS.items():
+        path = "/v1" + spec.endpoint_template[len(MDH_API_BASE_URL):]
+        pattern = re.escape(path).replace(r"\{date\}", "[^/]+").replace(r"\{hours\}", r"\d+")
+        routes[name] = re.compile(f"^{pattern}$")
+    return routes
+
+
+class MdhStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, num_records=1000, compress=True, **payload_options):
+        super().__init__((host, port), MdhStubHandler)
+        self.num_records = num_records
+        self.compress = compress
+        self.payload_options = payload_options
+        self.routes = dataset_routes()
+        self.payloads = {}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def payload(self, key, build):
+        """Build a payload once and keep it with its gzipped copy, requests then only pay for the transfer."""
+        with self.lock:
+            if key not in self.payloads:
+                body = build()
+                self.payloads[key] = (body, gzip.compress(body, compresslevel=1) if self.compress else None)
+            return self.payloads[key]
+
+    def dataset_payload(self, data_name):
+        return self.payload(data_name, lambda: encode_payload(data_name, self.num_records, **self.payload_options))
+
+
+class MdhStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, gzipped=None, headers=None):
+        use_gzip = gzipped is not None and "gzip" in self.headers.get("Accept-Encoding", "")
+        data = gzipped if use_gzip else body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+        if path == LOCATION_CODES_PATH:
+            host, port = self.server.server_address[:2]
+            return self.send_body(b"{}", headers={"Location": f"http://{host}:{port}{LOCATION_CODES_FILE_PATH}"})
+        if path == LOCATION_CODES_FILE_PATH:
+            return self.send_body(*self.server.payload("location_codes", lambda: json.dumps(location_codes()).encode("utf-8")))
+        for data_name, route in self.server.routes.items():
+            if route.match(path):
+                return self.send_body(*self.server.dataset_payload(data_name))
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve synthetic MDH payloads locally")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (default: any free port)")
+    parser.add_argument("--records", type=int, default=1000, help="Records per dataset response")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="Fraction of records repeating an earlier one")
+    parser.add_argument("--known-location-ratio", type=float, default=1.0, help="Fraction of location names with a location code")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-gzip", action="store_true", help="Never compress responses")
+    args = parser.parse_args()
+
+    server = MdhStubServer(
+        args.host, args.port, args.records, not args.no_gzip,
+        seed=args.seed, duplicate_ratio=args.duplicate_ratio, known_location_ratio=args.known_location_ratio
+    )
+    # The first line tells whoever started the stub where to point MDH_API_BASE_URL
+    print(server.base_url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,156 @@
+"""
+Request latency of the ETL API while many clients trigger ingestions, poll their jobs and
+check health at the same time, with the job workers running the triggered ingestions meanwhile.
+
+    python -m etl.bench.mdh_stub_server --records 10000
+    MDH_API_BASE_URL=<stub url> ETL_SERVICE_API_KEY=bench uvicorn etl.src.server:app --port 8080 --workers 4
+    python -m etl.bench.server_load_test --url http://localhost:8080 --api-key bench --clients 100 --seconds 30
+
+Every client sends one request after another on its own keep-alive connection, picking the
+endpoint at random with the weights given by --mix. Reports the latency percentiles, statuses
+and throughput of every endpoint.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Relative weights of the requests every client sends
+DEFAULT_MIX = "trigger=1,job=2,health=2"
+# Data windows picked at random by triggers, different windows are different jobs, equal ones are deduplicated
+TRIGGER_WINDOWS = [None, 1, 2, 3, 6, 12, 24]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+class LoadClient:
+    def __init__(self, url, api_key, timeout_seconds):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.api_key = api_key
+        self.timeout_seconds = timeout_seconds
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        """Returns (status, response body), status None if the request failed."""
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout_seconds)
+        headers = {"x-api-key": self.api_key, "Content-Type": "application/json"}
+        try:
+            self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self.conn.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            return None, None
+
+
+class ServerLoadTest:
+    def __init__(self, url, api_key, datasets, clients, seconds, mix, timeout_seconds=30):
+        self.url = url
+        self.api_key = api_key
+        self.datasets = datasets
+        self.clients = clients
+        self.seconds = seconds
+        self.mix = mix
+        self.timeout_seconds = timeout_seconds
+        self.job_ids = []
+        self.lock = threading.Lock()
+        # (endpoint, status, seconds) of every request sent
+        self.samples = []
+
+    def send(self, client, endpoint):
+        if endpoint == "trigger":
+            data_name = random.choice(self.datasets)
+            status, body = client.request("POST", "/trigger-ingestion", {data_name: random.choice(TRIGGER_WINDOWS)})
+            if status == 202:
+                with self.lock:
+                    self.job_ids.append(json.loads(body)["job_id"])
+            return status
+        if endpoint == "job":
+            with self.lock:
+                job_id = random.choice(self.job_ids) if self.job_ids else 1
+            return client.request("GET", f"/jobs/{job_id}")[0]
+        return client.request("GET", "/health")[0]
+
+    def run_client(self, deadline):
+        client = LoadClient(self.url, self.api_key, self.timeout_seconds)
+        endpoints, weights = zip(*self.mix.items())
+        samples = []
+        while time.monotonic() < deadline:
+            endpoint = random.choices(endpoints, weights)[0]
+            start = time.perf_counter()
+            status = self.send(client, endpoint)
+            samples.append((endpoint, status, time.perf_counter() - start))
+            if status is None:
+                # Server down or restarting, do not spin
+                time.sleep(0.1)
+        with self.lock:
+            self.samples.extend(samples)
+
+    def run(self):
+        deadline = time.monotonic() + self.seconds
+        with ThreadPoolExecutor(max_workers=self.clients) as executor:
+            for _ in range(self.clients):
+                executor.submit(self.run_client, deadline)
+        return self.report()
+
+    def report(self):
+        report = {"clients": self.clients, "seconds": self.seconds, "endpoints": {}}
+        for endpoint in self.mix:
+            samples = [(status, seconds) for name, status, seconds in self.samples if name == endpoint]
+            latencies_ms = [seconds * 1000 for _, seconds in samples]
+            statuses = {}
+            for status, _ in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            report["endpoints"][endpoint] = {
+                "requests": len(samples),
+                "per_second": round(len(samples) / self.seconds, 1),
+                "statuses": statuses,
+                **{f"p{p}_ms": round(percentile(latencies_ms, p), 1) if samples else None for p in (50, 95, 99)},
+                "max_ms": round(max(latencies_ms), 1) if samples else None,
+            }
+        return report
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        endpoint, weight = part.split("=")
+        if endpoint not in ("trigger", "job", "health"):
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {endpoint!r}, expected trigger, job or health.")
+        mix[endpoint] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    from etl.src.datasets import DATASETS
+
+    parser = argparse.ArgumentParser(description="Latency of the ETL API under concurrent triggers, job polls and health checks")
+    parser.add_argument("--url", default="http://localhost:8080", help="Base url of a running ETL API")
+    parser.add_argument("--api-key", required=True, help="ETL_SERVICE_API_KEY of the server")
+    parser.add_argument("--datasets", default=",".join(DATASETS), help="Comma-separated datasets triggered")
+    parser.add_argument("--clients", type=int, default=50, help="Number of concurrent clients")
+    parser.add_argument("--seconds", type=int, default=30, help="Duration of the test")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Request weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--output", default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    load_test = ServerLoadTest(args.url, args.api_key, args.datasets.split(","), args.clients, args.seconds, args.mix)
+    report = load_test.run()
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,106 @@
+import io
+import json
+import random
+
+from datetime import datetime, timedelta
+
+# Record field holding the event time (SGT) for each MDH dataset
+TIMESTAMP_FIELDS = {
+    "vessel_arrivals": "arrivedTime",
+    "vessel_departures": "departedTime",
+    "vessels_due_to_arrive": "duetoArriveTime",
+}
+# Datasets whose records carry locationFrom/locationTo
+LOCATION_DATASETS = {"vessel_arrivals", "vessels_due_to_arrive"}
+
+LOCATION_NAMES = [f"SYNTHETIC ANCHORAGE {i}" for i in range(50)]
+# Location names missing from the location codes, passed through unchanged by the transform
+UNKNOWN_LOCATION_NAMES = [f"UNLISTED BERTH {i}" for i in range(50)]
+# Earlier records kept around to draw duplicates from
+DUPLICATE_POOL_SIZE = 1000
+
+
+def edge_records(data_name):
+    """
+    Records every payload starts with, for the values staging must keep as they are: a record
+    without an event time or flag (both staged as NULL), and one with an empty call sign and the
+    characters COPY's text format escapes in its vessel name.
+    """
+    records = [
+        {
+            "vesselParticulars": {"vesselName": "SYNTHETIC VESSEL NO TIME", "callSign": "SNOTIME", "imoNumber": "8999999", "flag": None},
+            TIMESTAMP_FIELDS[data_name]: None,
+        },
+        {
+            "vesselParticulars": {"vesselName": 'SYNTHETIC\tVESSEL\\ "QUOTED"\nNAME', "callSign": "", "imoNumber": "8999998", "flag": "SINGAPORE"},
+            TIMESTAMP_FIELDS[data_name]: "2025-01-01 00:00:00",
+        },
+    ]
+    if data_name in LOCATION_DATASETS:
+        for record in records:
+            record["locationFrom"], record["locationTo"] = LOCATION_NAMES[0], None
+    return records
+
+
+def location_codes():
+    """Location reference entries, as served by MDH's location codes file."""
+    return [{"locationDescription": name, "locationCode": f"SA{i:02d}"} for i, name in enumerate(LOCATION_NAMES)]
+
+
+def location_code_mappings():
+    return {entry["locationDescription"]: entry["locationCode"] for entry in location_codes()}
+
+
+def iter_records(data_name, num_records, seed=0, end=None, window_hours=24, duplicate_ratio=0.0, known_location_ratio=1.0):
+    """
+    Yield num_records MDH-shaped vessel records for data_name with event times within the window.
+        duplicate_ratio: fraction of records repeating an earlier record, which the load skips
+        known_location_ratio: fraction of location names that have a location code
+    """
+    rng = random.Random(seed)
+    end = end or datetime(2025, 1, 1)
+    window_seconds = window_hours * 3600
+    num_vessels = max(1, num_records // 4)
+    pool = []
+    edges = edge_records(data_name)[:num_records]
+    yield from edges
+    for _ in range(num_records - len(edges)):
+        if pool and rng.random() < duplicate_ratio:
+            yield rng.choice(pool)
+            continue
+        vessel = rng.randrange(num_vessels)
+        event_time = end - timedelta(seconds=rng.randrange(window_seconds))
+        record = {
+            "vesselParticulars": {
+                "vesselName": f"SYNTHETIC VESSEL {vessel}",
+                "callSign": f"S{vessel:06d}",
+                "imoNumber": str(9000000 + vessel),
+                "flag": rng.choice(["SINGAPORE", "PANAMA", "LIBERIA", "MARSHALL ISLANDS"]),
+            },
+            TIMESTAMP_FIELDS[data_name]: event_time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        if data_name in LOCATION_DATASETS:
+            for field in ["locationFrom", "locationTo"]:
+                names = LOCATION_NAMES if rng.random() < known_location_ratio else UNKNOWN_LOCATION_NAMES
+                record[field] = rng.choice(names)
+        if len(pool) < DUPLICATE_POOL_SIZE:
+            pool.append(record)
+        else:
+            pool[rng.randrange(DUPLICATE_POOL_SIZE)] = record
+        yield record
+
+
+def generate_records(data_name, num_records, **kwargs):
+    return list(iter_records(data_name, num_records, **kwargs))
+
+
+def encode_payload(data_name, num_records, **kwargs):
+    """JSON array of synthetic records as UTF-8 bytes, encoded one record at a time to keep memory flat."""
+    buffer = io.BytesIO()
+    buffer.write(b"[")
+    for i, record in enumerate(iter_records(data_name, num_records, **kwargs)):
+        if i:
+            buffer.write(b",")
+        buffer.write(json.dumps(record).encode("utf-8"))
+    buffer.write(b"]")
+    return buffer.getvalue()
@@ -0,0 +1,83 @@
+"""
+Records/second of the transform step, comparing the original per-record transform
+(strptime + pytz localize + dict per row) with the columnar batch transform.
+
+    python -m etl.bench.transform_benchmark --records 100000
+"""
+import argparse
+import pytz
+import time
+
+from datetime import datetime
+from etl.bench.synthetic_payloads import generate_records, location_code_mappings
+from etl.src.datasets import DATASETS
+from etl.src.transform import MdhDataTransformer
+
+
+def per_record_transform(records, fetched_at, mappings, tz=pytz.timezone("Asia/Singapore")):
+    # The transform as it was before the batch engine, kept here as the baseline
+    rows = []
+    for record in records:
+        vessel_particulars = record["vesselParticulars"]
+        raw_arrival = record.get("arrivedTime")
+        if raw_arrival:
+            naive_ts = datetime.strptime(raw_arrival, "%Y-%m-%d %H:%M:%S")
+            arrival_utc = tz.localize(naive_ts).astimezone(pytz.UTC)
+        else:
+            arrival_utc = None
+        location_from = record["locationFrom"]
+        if location_from in mappings:
+            location_from = mappings.get(location_from)
+        location_to = record["locationTo"]
+        if location_to in mappings:
+            location_to = mappings.get(location_to)
+        rows.append({
+            "vessel_name": vessel_particulars["vesselName"],
+            "callsign": vessel_particulars["callSign"],
+            "imo": vessel_particulars["imoNumber"],
+            "flag": vessel_particulars["flag"],
+            "arrived_time": arrival_utc,
+            "location_from": location_from,
+            "location_to": location_to,
+            "fetched_at": fetched_at,
+        })
+    return rows
+
+
+def batch_transform(records, fetched_at, mappings):
+    transformer = MdhDataTransformer(None, DATASETS["vessel_arrivals"], mappings)
+    columns = transformer.transform_batch(fetched_at, records)
+    return list(zip(*columns.values()))
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(num_records, repeat):
+    records = generate_records("vessel_arrivals", num_records)
+    mappings = location_code_mappings()
+    fetched_at = datetime.now(pytz.UTC)
+
+    # Both must produce the same rows before their speed is worth comparing
+    expected = [tuple(row.values()) for row in per_record_transform(records, fetched_at, mappings)]
+    assert batch_transform(records, fetched_at, mappings) == expected
+
+    print(f"Transforming {num_records} vessel_arrivals records (best of {repeat}):")
+    for name, fn in [("per-record", per_record_transform), ("batch", batch_transform)]:
+        seconds = best_of(lambda: fn(records, fetched_at, mappings), repeat)
+        print(f"  {name:<12} {seconds:8.3f}s  {num_records / seconds:12,.0f} records/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vessel record transform")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.records, args.repeat)
@@ -0,0 +1,2 @@
+from .dataset_spec import DatasetSpec
+from .mdh_datasets import DATASETS, get_dataset
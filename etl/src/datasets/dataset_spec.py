@@ -0,0 +1,77 @@
+# Staging column type used for every column not listed in a spec's column_types
+DEFAULT_COLUMN_TYPE = 'text COLLATE pg_catalog."default"'
+TIMESTAMP_COLUMN_TYPE = "timestamp with time zone"
+
+
+class DatasetSpec:
+    """
+    Declarative definition of an MDH dataset, from which its staging table, transform and load are generated.
+        name: dataset name, also the name of its raw and final tables
+        endpoint: MDH url template with {date} (SGT, 'YYYY-MM-DD HH:MM:SS') and {hours} placeholders
+        default_window_hours: data window fetched when none is given and there is no high-water mark
+        fields: dict of {staging_column: record field}, nested fields as "vesselParticulars.vesselName"
+        timestamp_column: column of the event time, converted from SGT to UTC and used as high-water mark
+        identifier_columns: columns identifying a record in the final table
+        location_columns: columns of location names shortened to location codes
+        incremental: whether the window can be shrunk to what is new since the high-water mark
+        load_fetched_at: whether fetched_at is loaded into the final table too
+        column_types: dict of {staging_column: Postgres type} for columns that are not text
+        status_columns: dict of {final column: etl.vessel_status column} updated from newly inserted rows
+        status_order_column: column deciding which row of a vessel is the latest, the timestamp column by default
+    Everything derived from the definition is computed once here, when the registry is imported.
+    """
+    def __init__(self, name, endpoint, default_window_hours, fields, timestamp_column, identifier_columns,
+                 location_columns=(), incremental=True, load_fetched_at=False, column_types=None,
+                 status_columns=None, status_order_column=None):
+        self.name = name
+        self.endpoint_template = endpoint
+        self.default_window_hours = default_window_hours
+        self.fields = dict(fields)
+        self.timestamp_column = timestamp_column
+        self.identifier_columns = list(identifier_columns)
+        self.location_columns = list(location_columns)
+        self.incremental = incremental
+        self.load_fetched_at = load_fetched_at
+        self.status_columns = dict(status_columns or {})
+        self.status_order_column = status_order_column or timestamp_column
+
+        unknown = {timestamp_column, *self.identifier_columns, *self.location_columns} - set(self.fields)
+        if unknown:
+            raise ValueError(f"Columns {sorted(unknown)} of dataset {name} have no field mapping.")
+
+        self.column_types = {column: DEFAULT_COLUMN_TYPE for column in self.fields}
+        self.column_types[timestamp_column] = TIMESTAMP_COLUMN_TYPE
+        self.column_types.update(column_types or {})
+        self.column_types["fetched_at"] = TIMESTAMP_COLUMN_TYPE
+
+        self.field_keys = {column: tuple(field.split(".")) for column, field in self.fields.items()}
+        self.staging_columns = [*self.fields, "fetched_at"]
+        self.insert_columns = self.staging_columns if load_fetched_at else list(self.fields)
+        not_loaded = ({*self.status_columns, self.status_order_column} if self.status_columns else set()) - set(self.insert_columns)
+        if not_loaded:
+            raise ValueError(f"Status columns {sorted(not_loaded)} of dataset {name} are not loaded into its final table.")
+        self.staging_ddl = self.build_staging_ddl()
+        self.staging_table = f"pg_temp.staging_{name}"
+
+    def __repr__(self):
+        return f"DatasetSpec({self.name!r})"
+
+    @property
+    def uses_location_codes(self):
+        return bool(self.location_columns)
+
+    def endpoint(self, date, hours):
+        return self.endpoint_template.format(date=date, hours=hours)
+
+    def build_staging_ddl(self):
+        """
+        Staging is a temporary table private to each connection and emptied on every commit,
+        so concurrent runs of a dataset never see or truncate each other's staged rows.
+        """
+        columns = ",\n".join(f"                {column} {self.column_types[column]}" for column in self.staging_columns)
+        return f"""
+            CREATE TEMP TABLE IF NOT EXISTS staging_{self.name}
+            (
+{columns}
+            ) ON COMMIT DELETE ROWS
+            """
@@ -0,0 +1,93 @@
+import etl.src.util.env as env
+
+from etl.src.datasets.dataset_spec import DatasetSpec
+
+# Overridable to point the ETL at a local MDH stub server
+MDH_API_BASE_URL = env.optional_env("MDH_API_BASE_URL", "https://sg-mdh-api.mpa.gov.sg/v1")
+
+# Staging column -> field of a record's "vesselParticulars", shared by every MDH vessel dataset
+VESSEL_PARTICULARS_FIELDS = {
+    "vessel_name": "vesselParticulars.vesselName",
+    "callsign": "vesselParticulars.callSign",
+    "imo": "vesselParticulars.imoNumber",
+    "flag": "vesselParticulars.flag",
+}
+# Final table column -> etl.vessel_status column, for the vessel particulars every dataset keeps up to date
+VESSEL_PARTICULARS_STATUS_COLUMNS = {
+    "vessel_name": "vessel_name",
+    "callsign": "callsign",
+    "flag": "flag",
+}
+
+DATASETS = {
+    spec.name: spec
+    for spec in [
+        DatasetSpec(
+            name="vessel_arrivals",
+            endpoint=f"{MDH_API_BASE_URL}/vessel/arrivals/date/{{date}}/hours/{{hours}}",
+            default_window_hours=24,
+            fields={
+                **VESSEL_PARTICULARS_FIELDS,
+                "arrived_time": "arrivedTime",
+                "location_from": "locationFrom",
+                "location_to": "locationTo",
+            },
+            timestamp_column="arrived_time",
+            identifier_columns=["vessel_name", "imo", "arrived_time"],
+            location_columns=["location_from", "location_to"],
+            status_columns={
+                **VESSEL_PARTICULARS_STATUS_COLUMNS,
+                "arrived_time": "arrived_time",
+                "location_from": "arrived_from",
+                "location_to": "arrived_to",
+            },
+        ),
+        DatasetSpec(
+            name="vessel_departures",
+            endpoint=f"{MDH_API_BASE_URL}/vessel/departure/date/{{date}}/hours/{{hours}}",
+            default_window_hours=24,
+            fields={
+                **VESSEL_PARTICULARS_FIELDS,
+                "departed_time": "departedTime",
+            },
+            timestamp_column="departed_time",
+            identifier_columns=["vessel_name", "imo", "departed_time"],
+            status_columns={
+                **VESSEL_PARTICULARS_STATUS_COLUMNS,
+                "departed_time": "departed_time",
+            },
+        ),
+        DatasetSpec(
+            name="vessels_due_to_arrive",
+            endpoint=f"{MDH_API_BASE_URL}/vessel/duetoarrive/date/{{date}}/hours/{{hours}}",
+            default_window_hours=73,
+            fields={
+                **VESSEL_PARTICULARS_FIELDS,
+                "due_to_arrive_time": "duetoArriveTime",
+                "location_from": "locationFrom",
+                "location_to": "locationTo",
+            },
+            timestamp_column="due_to_arrive_time",
+            identifier_columns=["vessel_name", "imo", "due_to_arrive_time"],
+            location_columns=["location_from", "location_to"],
+            # Due to arrive records are forecasts that keep changing, they always use the full window
+            incremental=False,
+            load_fetched_at=True,
+            status_columns={
+                **VESSEL_PARTICULARS_STATUS_COLUMNS,
+                "due_to_arrive_time": "due_to_arrive_time",
+                "location_from": "due_from",
+                "location_to": "due_to",
+                "fetched_at": "due_fetched_at",
+            },
+            # A revised forecast replaces the vessel's due time even when it is earlier
+            status_order_column="fetched_at",
+        ),
+    ]
+}
+
+
+def get_dataset(data_name):
+    if data_name not in DATASETS:
+        raise ValueError(f"Unknown dataset: {data_name}")
+    return DATASETS[data_name]
@@ -0,0 +1,2 @@
+from .export_manifest import ExportManifest
+from .parquet_exporter import ParquetExporter
\ No newline at end of file
@@ -0,0 +1,61 @@
+import json
+import posixpath
+import uuid
+
+from datetime import datetime, timezone
+from pyarrow import fs as pafs
+
+MANIFEST_FILE = "_manifest.json"
+MANIFEST_VERSION = 1
+
+
+class ExportManifest:
+    """
+    _manifest.json at the root of a dataset's export: the Parquet files that make up the export
+    and the last change seq they contain. Readers only read the files listed here, files that are
+    not listed are left over from an interrupted export or compaction and are removed by the next
+    compaction. Saving replaces the whole manifest at once, so readers never see a partial one.
+    """
+    def __init__(self, fs, root, data_name):
+        self.fs = fs
+        self.root = root
+        self.data_name = data_name
+        self.path = posixpath.join(root, MANIFEST_FILE)
+        self.last_seq = None
+        self.columns = []
+        self.files = []
+
+    @property
+    def exists(self):
+        return self.last_seq is not None
+
+    def load(self):
+        if self.fs.get_file_info(self.path).type == pafs.FileType.NotFound:
+            return self
+        with self.fs.open_input_stream(self.path) as f:
+            manifest = json.loads(f.read())
+        self.last_seq = manifest["last_seq"]
+        self.columns = manifest["columns"]
+        self.files = manifest["files"]
+        return self
+
+    def save(self):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "data_name": self.data_name,
+            "last_seq": self.last_seq,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "num_rows": sum(file["num_rows"] for file in self.files),
+            "columns": self.columns,
+            "files": sorted(self.files, key=lambda file: (file["date"], file["path"])),
+        }
+        tmp_path = posixpath.join(self.root, f".{MANIFEST_FILE}.{uuid.uuid4().hex}")
+        with self.fs.open_output_stream(tmp_path) as f:
+            f.write(json.dumps(manifest, indent=2).encode("utf-8"))
+        self.fs.move(tmp_path, self.path)
+
+    def files_by_date(self):
+        by_date = {}
+        for file in self.files:
+            by_date.setdefault(file["date"], []).append(file)
+        return by_date
@@ -0,0 +1,200 @@
+import os
+import posixpath
+import uuid
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import etl.src.util.env as env
+
+from datetime import datetime, timezone
+from pyarrow import fs as pafs
+from etl.src.datasets.dataset_spec import TIMESTAMP_COLUMN_TYPE
+from etl.src.export.export_manifest import ExportManifest
+from etl.src.util.logger import logger
+
+# Where datasets are exported, a local directory or an S3 uri, e.g. s3://bucket/prefix?endpoint_override=http://minio:9000
+# for an S3-compatible store (credentials from the usual AWS_* variables). Nothing is exported when unset.
+EXPORT_URI = env.optional_env("ETL_EXPORT_URI", None)
+# Max number of rows read from the database and written per export step
+EXPORT_BATCH_ROWS = env.optional_env_int("ETL_EXPORT_BATCH_ROWS", 100000)
+# Dates with at least this many files have them merged into one file by compaction
+EXPORT_COMPACT_MIN_FILES = env.optional_env_int("ETL_EXPORT_COMPACT_MIN_FILES", 8)
+EXPORT_COMPRESSION = "zstd"
+
+# Seq of the change each row was exported from, NULL for the rows written by the first export
+SEQ_COLUMN = "change_seq"
+# Date partition of rows without an event time
+UNKNOWN_DATE = "unknown"
+# Arrow type of every column with a Postgres type other than text
+ARROW_TYPES = {TIMESTAMP_COLUMN_TYPE: pa.timestamp("us", tz="UTC")}
+
+
+def open_export_root(uri, data_name):
+    """Return the filesystem and root directory of a dataset's export under uri."""
+    if "://" not in uri:
+        uri = os.path.abspath(uri)
+    fs, path = pafs.FileSystem.from_uri(uri)
+    root = posixpath.join(path, data_name)
+    fs.create_dir(root, recursive=True)
+    return fs, root
+
+
+class ParquetExporter:
+    """
+    Exports the rows loaded into public.<data_name> to zstd-compressed Parquet files partitioned
+    by the UTC date of their event time, <root>/date=YYYY-MM-DD/part-<uuid>.parquet, listed in the
+    export's manifest. The first export writes the whole final table, every later one follows
+    etl.changes from the last seq in the manifest, so only newly loaded rows are read.
+    """
+    def __init__(self, conn, spec, fs, root, batch_rows=None):
+        self.conn = conn
+        self.spec = spec
+        self.data_name = spec.name
+        self.fs = fs
+        self.root = root
+        self.batch_rows = batch_rows or EXPORT_BATCH_ROWS
+        self.columns = spec.insert_columns
+        self.schema = pa.schema(
+            [(SEQ_COLUMN, pa.int64())]
+            + [(column, ARROW_TYPES.get(spec.column_types[column], pa.string())) for column in self.columns]
+        )
+        self.manifest = ExportManifest(fs, root, spec.name).load()
+
+    def record_exported(self, last_seq):
+        """Remember the last seq exported, the change feed keeps the changes after it when pruned."""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO etl.exports (data_name, last_seq, updated_at)
+                VALUES (%s, %s, now())
+                ON CONFLICT (data_name) DO UPDATE SET last_seq = EXCLUDED.last_seq, updated_at = now()
+                """,
+                (self.data_name, last_seq)
+            )
+
+    def commit_manifest(self, last_seq):
+        self.manifest.last_seq = last_seq
+        self.manifest.columns = [{"name": field.name, "type": str(field.type)} for field in self.schema]
+        self.manifest.save()
+        self.record_exported(last_seq)
+        self.conn.commit()
+
+    def write_table(self, date, table):
+        """Write a table to a new file of the date's partition and return its manifest entry."""
+        relative_path = posixpath.join(f"date={date}", f"part-{uuid.uuid4().hex}.parquet")
+        path = posixpath.join(self.root, relative_path)
+        self.fs.create_dir(posixpath.dirname(path), recursive=True)
+        pq.write_table(table, path, filesystem=self.fs, compression=EXPORT_COMPRESSION)
+        seqs = pc.min_max(table[SEQ_COLUMN])
+        return {
+            "path": relative_path,
+            "date": date,
+            "num_rows": table.num_rows,
+            "min_seq": seqs["min"].as_py(),
+            "max_seq": seqs["max"].as_py(),
+            "size_bytes": self.fs.get_file_info(path).size,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def write_rows(self, rows):
+        """
+        Write rows of (seq, *columns) with one new file per date and add the files to the manifest.
+        Returns the number of rows written.
+        """
+        timestamp_index = 1 + self.columns.index(self.spec.timestamp_column)
+        by_date = {}
+        for row in rows:
+            event_time = row[timestamp_index]
+            date = event_time.astimezone(timezone.utc).date().isoformat() if event_time else UNKNOWN_DATE
+            by_date.setdefault(date, []).append(row)
+        for date, date_rows in by_date.items():
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*date_rows), self.schema)]
+            self.manifest.files.append(self.write_table(date, pa.Table.from_arrays(arrays, schema=self.schema)))
+        return len(rows)
+
+    def export_table(self):
+        """Write every row of the final table, the changes committed after it was read are exported next."""
+        # Read the last seq and the table in one snapshot: a load inserts its rows and their changes together
+        self.conn.commit()
+        with self.conn.cursor() as cur:
+            cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            cur.execute("SELECT coalesce(max(seq), 0) FROM etl.changes")
+            (last_seq,) = cur.fetchone()
+        num_rows = 0
+        with self.conn.cursor(f"{self.data_name}_export") as cur:
+            cur.itersize = self.batch_rows
+            cur.execute(
+                f"""
+                SELECT NULL::bigint, {', '.join(self.columns)}
+                FROM public.{self.data_name}
+                ORDER BY {self.spec.timestamp_column}
+                """
+            )
+            while True:
+                rows = cur.fetchmany(self.batch_rows)
+                if not rows:
+                    break
+                num_rows += self.write_rows(rows)
+        self.commit_manifest(last_seq)
+        return num_rows
+
+    def export_changes(self):
+        """Write the rows inserted since the last export, committing the manifest after every batch."""
+        num_rows = 0
+        while True:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    f"""
+                    SELECT c.seq, {', '.join(f"r.{column}" for column in self.columns)}
+                    FROM etl.changes c
+                    CROSS JOIN LATERAL jsonb_populate_record(NULL::public.{self.data_name}, c.row_data) r
+                    WHERE c.data_name = %s
+                    AND c.op = 'insert'
+                    AND c.seq > %s
+                    ORDER BY c.seq
+                    LIMIT %s
+                    """,
+                    (self.data_name, self.manifest.last_seq, self.batch_rows)
+                )
+                rows = cur.fetchall()
+            if not rows:
+                break
+            num_rows += self.write_rows(rows)
+            self.commit_manifest(rows[-1][0])
+            if len(rows) < self.batch_rows:
+                break
+        return num_rows
+
+    def export(self):
+        """Export what was loaded since the last export. Returns the number of rows written."""
+        num_rows = 0
+        if not self.manifest.exists:
+            logger.info(f"First export of {self.data_name}, writing the whole final table...")
+            num_rows += self.export_table()
+        return num_rows + self.export_changes()
+
+    def compact(self, min_files=None):
+        """
+        Merge the files of every date that has at least min_files of them into one file sorted by
+        event time, then delete the merged files and any file the manifest does not list.
+        Returns the number of files deleted.
+        """
+        min_files = min_files or EXPORT_COMPACT_MIN_FILES
+        for date, files in self.manifest.files_by_date().items():
+            if len(files) < min_files:
+                continue
+            tables = [pq.read_table(posixpath.join(self.root, file["path"]), filesystem=self.fs, schema=self.schema) for file in files]
+            table = pa.concat_tables(tables).sort_by([(self.spec.timestamp_column, "ascending"), (SEQ_COLUMN, "ascending")])
+            merged = self.write_table(date, table)
+            self.manifest.files = [file for file in self.manifest.files if file["date"] != date] + [merged]
+            logger.debug(f"Merged {len(files)} export file(s) of {self.data_name} for {date} into {merged['path']}.")
+        self.manifest.save()
+
+        listed = {posixpath.join(self.root, file["path"]) for file in self.manifest.files}
+        unlisted = [
+            info.path for info in self.fs.get_file_info(pafs.FileSelector(self.root, recursive=True))
+            if info.type == pafs.FileType.File and info.path.endswith(".parquet") and info.path not in listed
+        ]
+        for path in unlisted:
+            self.fs.delete_file(path)
+        return len(unlisted)
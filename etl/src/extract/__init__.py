@@ -1 +1,2 @@
-from .data_fetcher import DataFetcher
\ No newline at end of file
+from .data_fetcher import DataFetcher
+from .mdh_client import MdhClient, CircuitBreaker, CircuitOpenError, get_mdh_client
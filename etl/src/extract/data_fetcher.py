@@ -1,6 +1,9 @@
-import requests
-import json
+import hashlib
+import psycopg2
+import time
 from datetime import datetime
+from etl.src.extract.mdh_client import get_mdh_client
+from etl.src.util.binary_copy import BinaryCopyRow, bool_field, int4_field, jsonb_field, text_field
 from etl.src.util.logger import logger
 
 class DataFetcher:
@@ -8,35 +11,91 @@ class DataFetcher:
         self.data_name = data_name
         self.endpoint = endpoint
         self.api_key = api_key
+        self.bytes_received = 0
+        self.fetch_seconds = 0.0
+        # Whether the saved response is identical to one already processed, it is then saved as processed
+        self.unchanged = False
 
     def call_api(self):
+        """
+        Returns (status_code, response_body, error), response_body is the raw JSON
+        bytes as received, it is never decoded into Python objects here.
+        """
+        r = None
+        start = time.perf_counter()
         try:
-            r = requests.get(self.endpoint, headers={"apikey": self.api_key}, timeout=10)
+            r, body = get_mdh_client().get_body(self.endpoint, headers={"apikey": self.api_key}, timeout=10)
             r.raise_for_status()
-            data = r.json()
-            return r.status_code, data, None
+            self.bytes_received = len(body)
+            return r.status_code, body, None
         except Exception as e:
-            err_details = r.json() if r else e
+            status_code = r.status_code if r is not None else None
+            err_details = f"{e}: {r.text}" if r is not None and not r.ok else e
             # logger.error(f"Error trying to fetch '{api}': {err_details}")
-            return getattr(e, "status_code", None), None, str(err_details)
+            return status_code, None, str(err_details)
+        finally:
+            self.fetch_seconds = time.perf_counter() - start
 
-    def save_raw(self, conn, status_code, response_json, details=None):
+    def save_raw(self, conn, status_code, response_body, details=None):
+        """
+        Insert the response into raw.<data_name> with a binary COPY, which streams the body as
+        received: it is not decoded or escaped into the statement, so no other copy of it is made.
+        Postgres parses it into jsonb, raising a DataError for anything that is not valid JSON.
+        """
+        payload_hash = hashlib.sha256(response_body).digest() if response_body is not None else None
         with conn.cursor() as cur:
-            cur.execute(
+            self.unchanged = False
+            if payload_hash is not None:
+                cur.execute(
+                    f"""
+                    SELECT EXISTS (
+                        SELECT 1 FROM raw.{self.data_name}
+                        WHERE payload_hash = %s
+                        AND status_code = 200 AND processed = true
+                    )
+                    """,
+                    (payload_hash,)
+                )
+                (self.unchanged,) = cur.fetchone()
+            row = BinaryCopyRow([
+                text_field(self.endpoint),
+                int4_field(status_code),
+                jsonb_field(response_body),
+                text_field(details),
+                payload_hash,
+                bool_field(self.unchanged),
+            ])
+            cur.copy_expert(
                 f"""
-                INSERT INTO raw.{self.data_name}
-                    (endpoint, status_code, response_json, details)
-                VALUES
-                    (%s, %s, %s, %s)
-                RETURNING id
+                COPY raw.{self.data_name} (endpoint, status_code, response_json, details, payload_hash, processed)
+                FROM STDIN (FORMAT binary)
                 """,
-                (self.endpoint, status_code, json.dumps(response_json) if response_json is not None else None, details)
+                row
             )
-        
-    def fetch_and_save(self, conn):
-        status, data, err = self.call_api()
-        with conn:
-            self.save_raw(conn, status if status else 0, data, err)      
+            cur.execute(f"SELECT currval(pg_get_serial_sequence('raw.{self.data_name}', 'id'))")
+            (raw_id,) = cur.fetchone()
+            if self.unchanged:
+                logger.info(f"Response for {self.data_name} is identical to one already processed, it will not be transformed again.")
+            return raw_id
+
+    def save(self, conn, status, body, err):
+        """
+        Commit the outcome of call_api() to raw.<data_name>, raising if the fetch failed.
+        Returns the id of the raw row.
+        """
+        try:
+            with conn:
+                raw_id = self.save_raw(conn, status if status else 0, body, err)
+        except psycopg2.DataError as e:
+            # Upstream answered with something that is not valid JSON, keep a record of the failed fetch
+            err = f"Invalid JSON in response: {e}"
+            with conn:
+                self.save_raw(conn, status if status else 0, None, err)
+            raise Exception(f'Data fetch for {self.data_name} failed: "{err}".')
         if not status or status >= 300:
             raise Exception(f'Data fetch for {self.data_name} failed: "{err}".')
-        
+        return raw_id
+
+    def fetch_and_save(self, conn):
+        status, body, err = self.call_api()
+        return self.save(conn, status, body, err)
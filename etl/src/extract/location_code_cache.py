@@ -0,0 +1,157 @@
+import threading
+import time
+import etl.src.util.env as env
+
+from psycopg2.extras import execute_values
+from etl.src.datasets import DATASETS
+from etl.src.datasets.mdh_datasets import MDH_API_BASE_URL
+from etl.src.extract.mdh_client import get_mdh_client
+from etl.src.init_db import EtlDbInitializer
+from etl.src.util.db import get_pool
+from etl.src.util.logger import logger
+
+LOCATION_CODES_ENDPOINT = f"{MDH_API_BASE_URL}/mdhvessel/reference/locations/filetype/json"
+# How long a copy of the location codes is used before checking upstream for changes
+LOCATION_CODES_TTL_SECONDS = env.optional_env_int("LOCATION_CODES_TTL_SECONDS", 24 * 60 * 60)
+
+
+class LocationCodeCache:
+    """
+    Location description -> location code mappings, held in memory and persisted to
+    reference.location_codes. Upstream is only contacted once the TTL has expired, with
+    a conditional request so an unchanged file is not downloaded again. If upstream is
+    unavailable the last good copy is used.
+    """
+    def __init__(self, DB_URL, MDH_API_KEY, ttl_seconds=LOCATION_CODES_TTL_SECONDS):
+        self.DB_URL = DB_URL
+        self.MDH_API_KEY = MDH_API_KEY
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.mappings = None
+        self.etag = None
+        self.last_modified = None
+        self.checked_at = None
+        self.migrated = False
+
+    def is_fresh(self):
+        return self.checked_at is not None and time.time() - self.checked_at < self.ttl_seconds
+
+    def load_stored(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT etag, last_modified, extract(epoch FROM checked_at)
+                FROM reference.location_codes_meta
+                WHERE id = 1
+                """
+            )
+            meta = cur.fetchone()
+            if meta is None:
+                return
+            cur.execute("SELECT location_description, location_code FROM reference.location_codes")
+            self.mappings = dict(cur.fetchall())
+            self.etag, self.last_modified = meta[0], meta[1]
+            self.checked_at = float(meta[2]) if meta[2] is not None else None
+
+    def fetch_upstream(self):
+        """
+        Returns (status_code, location_codes_json, etag, last_modified), location_codes_json
+        is None when upstream reports the file has not changed.
+        """
+        try:
+            r = get_mdh_client().get(LOCATION_CODES_ENDPOINT, headers={"apikey": self.MDH_API_KEY}, allow_redirects=True, timeout=10)
+            r.raise_for_status()
+            location_header = r.headers.get('Location')
+        except Exception as e:
+            raise Exception(f'Data fetch for location_codes resource location failed: "{e}".')
+
+        headers = {}
+        if self.mappings is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        try:
+            r = get_mdh_client().get(location_header, headers=headers, timeout=30)
+            if r.status_code == 304:
+                return r.status_code, None, self.etag, self.last_modified
+            r.raise_for_status()
+            return r.status_code, r.json(), r.headers.get("ETag"), r.headers.get("Last-Modified")
+        except Exception as e:
+            raise Exception(f'Data fetch for location_codes data failed: "{e}".')
+
+    def save_stored(self, conn, location_codes_json, etag, last_modified):
+        with conn.cursor() as cur:
+            if location_codes_json is not None:
+                cur.execute("TRUNCATE reference.location_codes")
+                execute_values(
+                    cur,
+                    "INSERT INTO reference.location_codes (location_description, location_code) VALUES %s ON CONFLICT DO NOTHING",
+                    [(entry['locationDescription'], entry['locationCode']) for entry in location_codes_json]
+                )
+            cur.execute(
+                """
+                INSERT INTO reference.location_codes_meta (id, etag, last_modified, refreshed_at, checked_at)
+                VALUES (1, %s, %s, now(), now())
+                ON CONFLICT (id) DO UPDATE SET
+                    etag = EXCLUDED.etag,
+                    last_modified = EXCLUDED.last_modified,
+                    refreshed_at = CASE WHEN %s THEN now() ELSE reference.location_codes_meta.refreshed_at END,
+                    checked_at = now()
+                """,
+                (etag, last_modified, location_codes_json is not None)
+            )
+        conn.commit()
+
+    def refresh(self, conn):
+        status_code, location_codes_json, etag, last_modified = self.fetch_upstream()
+        self.save_stored(conn, location_codes_json, etag, last_modified)
+        if location_codes_json is not None:
+            self.mappings = {entry['locationDescription']: entry['locationCode'] for entry in location_codes_json}
+            logger.info(f"Data fetched for location code values: {len(location_codes_json)} entries.")
+        else:
+            logger.info(f"Location code values unchanged upstream (status {status_code}), keeping {len(self.mappings)} cached entries.")
+        self.etag, self.last_modified = etag, last_modified
+        self.checked_at = time.time()
+
+    def get_mappings(self):
+        """Return the location description -> location code mappings, refreshing them if stale."""
+        with self.lock:
+            if self.mappings is not None and self.is_fresh():
+                return self.mappings
+
+            with get_pool(self.DB_URL).connection() as conn:
+                if not self.migrated:
+                    # reference.location_codes is created by the ETL schema migration of the datasets using it
+                    for data_name, spec in DATASETS.items():
+                        if spec.uses_location_codes:
+                            EtlDbInitializer(conn, data_name).init_etl_db()
+                    conn.commit()
+                    self.migrated = True
+                self.load_stored(conn)
+                if self.mappings is not None and self.is_fresh():
+                    logger.debug(f"Using stored location code values: {len(self.mappings)} entries.")
+                    return self.mappings
+
+                logger.info(f"Fetching latest location code values...")
+                try:
+                    self.refresh(conn)
+                except Exception as e:
+                    conn.rollback()
+                    if self.mappings is None:
+                        raise
+                    logger.warning(f"{e} Falling back to last good copy of location code values ({len(self.mappings)} entries).")
+            return self.mappings
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_location_code_cache(DB_URL, MDH_API_KEY):
+    """Return the process-wide location code cache."""
+    with _caches_lock:
+        cache = _caches.get(DB_URL)
+        if cache is None:
+            cache = LocationCodeCache(DB_URL, MDH_API_KEY)
+            _caches[DB_URL] = cache
+        return cache
@@ -0,0 +1,185 @@
+import random
+import requests
+import threading
+import time
+import etl.src.util.env as env
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from etl.src.util.logger import logger
+
+# Retries after the first attempt for connection errors, timeouts and the statuses below
+MDH_HTTP_MAX_RETRIES = env.optional_env_int("MDH_HTTP_MAX_RETRIES", 3)
+# Backoff before retry n is a random delay of up to BACKOFF_SECONDS * 2**n, capped at MAX_BACKOFF_SECONDS
+MDH_HTTP_BACKOFF_SECONDS = env.optional_env_int("MDH_HTTP_BACKOFF_SECONDS", 1)
+MDH_HTTP_MAX_BACKOFF_SECONDS = env.optional_env_int("MDH_HTTP_MAX_BACKOFF_SECONDS", 30)
+# Keep-alive connections kept per host, at least the number of datasets fetched at the same time
+MDH_HTTP_POOL_SIZE = env.optional_env_int("MDH_HTTP_POOL_SIZE", 10)
+# Consecutive failed attempts against a host after which calls to it fail fast...
+MDH_CIRCUIT_FAILURE_THRESHOLD = env.optional_env_int("MDH_CIRCUIT_FAILURE_THRESHOLD", 5)
+# ...until this many seconds have passed and a trial call is let through
+MDH_CIRCUIT_RESET_SECONDS = env.optional_env_int("MDH_CIRCUIT_RESET_SECONDS", 60)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Size of the chunks response bodies are read in
+RESPONSE_CHUNK_SIZE = 64 * 1024
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Fails calls to a host fast after failure_threshold consecutive failures, until reset_seconds have passed."""
+    def __init__(self, name, failure_threshold=MDH_CIRCUIT_FAILURE_THRESHOLD, reset_seconds=MDH_CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                raise CircuitOpenError(f"Circuit for {self.name} is open after {self.failures} consecutive failure(s), not retrying for {remaining:.0f}s.")
+            # Half open: let the call through as a trial, another failure opens the circuit again
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed.")
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} consecutive failure(s).")
+                self.opened_at = time.monotonic()
+
+
+def retry_after_seconds(response):
+    """Seconds to wait according to the Retry-After header (delay-seconds or HTTP-date), None if absent or invalid."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class MdhClient:
+    """
+    HTTP client shared by every MDH call in the process: one keep-alive session with a
+    connection pool per host, gzip responses, retries with jittered exponential backoff
+    honouring Retry-After, and a circuit breaker per host.
+    """
+    def __init__(self, max_retries=MDH_HTTP_MAX_RETRIES, backoff_seconds=MDH_HTTP_BACKOFF_SECONDS,
+                 max_backoff_seconds=MDH_HTTP_MAX_BACKOFF_SECONDS, pool_size=MDH_HTTP_POOL_SIZE):
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self.breakers = {}
+        self.breakers_lock = threading.Lock()
+
+    def breaker(self, url):
+        host = urlsplit(url).netloc
+        with self.breakers_lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host)
+            return self.breakers[host]
+
+    def backoff(self, retry, response):
+        retry_after = retry_after_seconds(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff_seconds)
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** retry))
+
+    def send(self, method, url, read_body=None, **kwargs):
+        """
+        Send a request, retrying connection errors, timeouts and retryable statuses.
+        read_body, if given, is called with successful responses to read their body,
+        failures while reading are retried too.
+        Returns (response, body). After the last retry the failed response is returned,
+        or the last exception raised.
+        """
+        breaker = self.breaker(url)
+        retry = 0
+        while True:
+            breaker.before_call()
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    body = read_body(response) if read_body is not None and response.ok else None
+                    breaker.record_success()
+                    return response, body
+                if retry >= self.max_retries:
+                    breaker.record_failure()
+                    return response, None
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                if retry >= self.max_retries:
+                    breaker.record_failure()
+                    raise
+                error = e
+            breaker.record_failure()
+            delay = self.backoff(retry, response)
+            if response is not None:
+                # Reading the (small) error body releases the keep-alive connection back to the pool
+                try:
+                    response.content
+                except requests.RequestException:
+                    response.close()
+            retry += 1
+            logger.warning(f"{method} {urlsplit(url).path} failed ({error}), retry {retry}/{self.max_retries} in {delay:.1f}s...")
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        response, _ = self.send("GET", url, **kwargs)
+        return response
+
+    def get_body(self, url, chunk_size=RESPONSE_CHUNK_SIZE, **kwargs):
+        """
+        GET url and read the whole (decompressed) body as bytes, without decoding it.
+        Returns (response, body), body is None for unsuccessful responses.
+        """
+        def read_body(response):
+            body = bytearray()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                body.extend(chunk)
+            return body
+        return self.send("GET", url, read_body=read_body, stream=True, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_mdh_client():
+    """Return the process-wide MDH client."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MdhClient()
+        return _client
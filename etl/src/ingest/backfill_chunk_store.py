@@ -0,0 +1,47 @@
+DONE = "done"
+FAILED = "failed"
+
+
+class BackfillChunkStore:
+    """
+    Outcome of every backfill chunk of a dataset in etl.backfill_chunks, so an interrupted
+    backfill resumes where it stopped. Windows are naive SGT times, as sent to MDH.
+    """
+    def __init__(self, conn, data_name):
+        self.conn = conn
+        self.data_name = data_name
+
+    def completed_windows(self, start, end):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT window_start, window_end
+                FROM etl.backfill_chunks
+                WHERE data_name = %s
+                AND status = 'done'
+                AND window_start >= %s
+                AND window_end <= %s
+                """,
+                (self.data_name, start, end)
+            )
+            return set(cur.fetchall())
+
+    def record(self, window, status, raw_id=None, rows_staged=None, rows_inserted=None, error=None):
+        window_start, window_end = window
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO etl.backfill_chunks
+                    (data_name, window_start, window_end, status, raw_id, rows_staged, rows_inserted, error, attempts)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1)
+                ON CONFLICT (data_name, window_start, window_end) DO UPDATE SET
+                    status = EXCLUDED.status,
+                    raw_id = EXCLUDED.raw_id,
+                    rows_staged = EXCLUDED.rows_staged,
+                    rows_inserted = EXCLUDED.rows_inserted,
+                    error = EXCLUDED.error,
+                    attempts = etl.backfill_chunks.attempts + 1,
+                    updated_at = now()
+                """,
+                (self.data_name, window_start, window_end, status, raw_id, rows_staged, rows_inserted, error)
+            )
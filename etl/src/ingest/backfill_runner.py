@@ -0,0 +1,115 @@
+import math
+import traceback
+import etl.src.util.env as env
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from etl.src.datasets import get_dataset
+from etl.src.extract import DataFetcher
+from etl.src.ingest.backfill_chunk_store import BackfillChunkStore, DONE, FAILED
+from etl.src.ingest.watermark_store import WatermarkStore
+from etl.src.init_db import EtlDbInitializer
+from etl.src.load import MdhDataLoader
+from etl.src.transform import MdhDataTransformer
+from etl.src.util.db import get_pool
+from etl.src.util.logger import logger
+
+# Hours of data fetched per backfill request
+BACKFILL_CHUNK_HOURS = env.optional_env_int("ETL_BACKFILL_CHUNK_HOURS", 24)
+# Max number of backfill chunks of a dataset fetched at the same time
+BACKFILL_MAX_CONCURRENCY = env.optional_env_int("ETL_BACKFILL_MAX_CONCURRENCY", 4)
+
+
+class BackfillRunner:
+    """
+    Loads the history of a dataset between start and end (naive SGT datetimes) as a series of
+    chunk_hours windows. Windows are fetched in parallel, each one is then staged and loaded
+    in its own transaction and recorded in etl.backfill_chunks, windows already loaded by an
+    earlier run are skipped.
+    """
+    def __init__(self, DB_URL, MDH_API_KEY, data_name, start, end, location_code_mappings=None,
+                 chunk_hours=None, max_concurrency=None):
+        self.DB_URL = DB_URL
+        self.MDH_API_KEY = MDH_API_KEY
+        self.spec = get_dataset(data_name)
+        self.data_name = data_name
+        self.start = start
+        self.end = end
+        self.location_code_mappings = location_code_mappings
+        self.chunk_hours = chunk_hours or BACKFILL_CHUNK_HOURS
+        self.max_concurrency = max_concurrency or BACKFILL_MAX_CONCURRENCY
+        if not self.spec.incremental:
+            raise ValueError(f"Backfill is not supported for {data_name}, its records are not past events.")
+        if start >= end:
+            raise ValueError(f"Backfill start {start} must be before end {end}.")
+        if self.chunk_hours < 1:
+            raise ValueError("Backfill chunk_hours must be at least 1.")
+
+    def windows(self):
+        windows = []
+        window_start = self.start
+        while window_start < self.end:
+            window_end = min(window_start + timedelta(hours=self.chunk_hours), self.end)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        return windows
+
+    def load_chunk(self, conn, fetcher, status, body, err, window):
+        """Save the fetched window to raw, then stage and load only that raw row. Returns (raw_id, rows_staged, rows_inserted)."""
+        raw_id = fetcher.save(conn, status, body, err)
+        transformer = MdhDataTransformer(conn, self.spec, self.location_code_mappings)
+        num_rows_staged = transformer.transform(raw_ids=[raw_id])
+        loader = MdhDataLoader(conn, self.spec)
+        num_rows_inserted = loader.load() if num_rows_staged else 0
+        WatermarkStore(conn, self.data_name).advance(loader.max_staged_event_time() if num_rows_staged else None)
+        BackfillChunkStore(conn, self.data_name).record(window, DONE, raw_id, num_rows_staged, num_rows_inserted)
+        conn.commit()
+        return raw_id, num_rows_staged, num_rows_inserted
+
+    def run_chunk(self, window):
+        window_start, window_end = window
+        hours = math.ceil((window_end - window_start) / timedelta(hours=1))
+        endpoint = self.spec.endpoint(window_end.strftime('%Y-%m-%d %H:%M:%S'), hours)
+        fetcher = DataFetcher(self.data_name, endpoint, self.MDH_API_KEY)
+        # Fetch before taking a connection, so slow responses do not hold one
+        status, body, err = fetcher.call_api()
+        with get_pool(self.DB_URL).connection() as conn:
+            try:
+                raw_id, num_rows_staged, num_rows_inserted = self.load_chunk(conn, fetcher, status, body, err, window)
+                logger.info(f"Backfilled {self.data_name} {window_start} - {window_end}: {num_rows_inserted} of {num_rows_staged} row(s) inserted.")
+                return {"status": DONE, "rows_staged": num_rows_staged, "rows_inserted": num_rows_inserted}
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error backfilling {self.data_name} {window_start} - {window_end}: {e}")
+                traceback.print_exc()
+                BackfillChunkStore(conn, self.data_name).record(window, FAILED, error=str(e))
+                conn.commit()
+                return {"status": FAILED, "error": str(e)}
+
+    def run(self):
+        """Returns a summary of the chunks run, skipped and failed, failed chunks are retried by running again."""
+        with get_pool(self.DB_URL).connection() as conn:
+            EtlDbInitializer(conn, self.data_name).init_etl_db()
+            conn.commit()
+            completed = BackfillChunkStore(conn, self.data_name).completed_windows(self.start, self.end)
+            conn.commit()
+
+        windows = self.windows()
+        pending = [window for window in windows if window not in completed]
+        logger.info(f"Backfilling {self.data_name} from {self.start} to {self.end}: {len(pending)} of {len(windows)} chunk(s) of {self.chunk_hours}h to run, max_concurrency={self.max_concurrency}...")
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=f"backfill-{self.data_name}") as executor:
+            outcomes = list(executor.map(self.run_chunk, pending))
+
+        failed = [
+            {"window_start": str(window[0]), "window_end": str(window[1]), "error": outcome["error"]}
+            for window, outcome in zip(pending, outcomes) if outcome["status"] == FAILED
+        ]
+        return {
+            "data_name": self.data_name,
+            "chunks": len(windows),
+            "skipped": len(windows) - len(pending),
+            "loaded": len(pending) - len(failed),
+            "failed": failed,
+            "rows_staged": sum(outcome.get("rows_staged", 0) for outcome in outcomes),
+            "rows_inserted": sum(outcome.get("rows_inserted", 0) for outcome in outcomes),
+        }
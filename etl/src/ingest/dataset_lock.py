@@ -0,0 +1,56 @@
+import time
+import etl.src.util.env as env
+
+from etl.src.util.logger import logger
+
+# Seconds a queued ingestion job waits for a run of the same dataset elsewhere to finish before failing
+DATASET_LOCK_WAIT_SECONDS = env.optional_env_int("ETL_DATASET_LOCK_WAIT_SECONDS", 300)
+# How often a waiting ingestion tries to take the lock again
+DATASET_LOCK_POLL_SECONDS = 1
+
+
+class DatasetLock:
+    """
+    Session-level advisory lock held for a whole ingestion of a dataset, across the commits of its
+    batches, so runs of the same dataset from cron, API triggers and other replicas never overlap.
+    The lock is released with the session if the process dies. Other work on a dataset that must
+    not overlap, such as exports, takes it under its own namespace.
+    """
+    def __init__(self, conn, data_name, namespace="etl_ingest"):
+        self.conn = conn
+        self.data_name = data_name
+        self.namespace = namespace
+        self.held = False
+
+    def try_acquire(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(hashtext(%s), hashtext(%s))", (self.namespace, self.data_name))
+            self.held = cur.fetchone()[0]
+        # Session-level locks outlive the transaction, end it so the connection is not left idle in transaction
+        self.conn.commit()
+        return self.held
+
+    def acquire(self, wait_seconds=0):
+        """
+        Take the lock, waiting up to wait_seconds for another run to release it.
+        Returns whether the lock was taken.
+        """
+        deadline = time.monotonic() + wait_seconds
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(min(DATASET_LOCK_POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+        return True
+
+    def release(self):
+        if not self.held:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(hashtext(%s), hashtext(%s))", (self.namespace, self.data_name))
+            self.conn.commit()
+        except Exception as e:
+            # Close the session so the lock cannot outlive it on a pooled connection
+            logger.warning(f"Error releasing the {self.namespace} lock of {self.data_name}, closing the connection: {e}")
+            self.conn.close()
+        self.held = False
@@ -1,71 +1,240 @@
-import psycopg2
+import json
 import traceback
 import etl.src.util.env as env
 
-from datetime import datetime
-from etl.src.init_db import EtlDbInitializer
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from datetime import datetime, timezone
+from etl.src.datasets import get_dataset
+from etl.src.ingest.backfill_runner import BackfillRunner
+from etl.src.ingest.dataset_lock import DatasetLock
+from etl.src.ingest.replay_runner import ReplayRunner
+from etl.src.init_db import EtlDbInitializer, RawPartitionManager
 from etl.src.extract import DataFetcher
-from etl.src.transform import VesselArrivalsTransformer, VesselDeparturesTransformer, VesselsDueToArriveTransformer
-from etl.src.load import MdhVesselArrivalsLoader, MdhVesselDeparturesLoader, MdhVesselsDueToArriveLoader
+from etl.src.export.parquet_exporter import EXPORT_URI, ParquetExporter, open_export_root
+from etl.src.transform import MdhDataTransformer, RecordHashStore
+from etl.src.transform.mdh_data_transformer import SGT_UTC_OFFSET
+from etl.src.load import ChangeFeed, MdhDataLoader
+from etl.src.ingest.watermark_store import WatermarkStore
+from etl.src.util.db import get_pool
 from etl.src.util.logger import logger
+from etl.src.util.metrics import MetricsRegistry, RunMetrics
+
+# Max number of datasets ingested at the same time
+MAX_CONCURRENCY = env.optional_env_int("ETL_MAX_CONCURRENCY", 3)
 
-class MdhApiIngestor:
-    def ingest(DB_URL, MDH_API_KEY, data_name, data_window_hours, location_code_mappings):
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        apis = {
-            "vessel_arrivals": f"https://sg-mdh-api.mpa.gov.sg/v1/vessel/arrivals/date/{now}/hours/{data_window_hours}",
-            "vessel_departures": f"https://sg-mdh-api.mpa.gov.sg/v1/vessel/departure/date/{now}/hours/{data_window_hours}",
-            "vessels_due_to_arrive": f"https://sg-mdh-api.mpa.gov.sg/v1/vessel/duetoarrive/date/{now}/hours/{data_window_hours}",
-        }
 
+class MdhApiIngestor:
+    def ingest(DB_URL, MDH_API_KEY, data_name, data_window_hours, location_code_mappings, metrics=None, lock_wait_seconds=0):
+        """
+        Fetch, transform and load one dataset. When data_window_hours is None the window
+        is derived from the dataset's high-water mark, falling back to its default window.
+        Stage timings and counters are collected into metrics (a RunMetrics) if given.
+        If the dataset is being ingested elsewhere, waits up to lock_wait_seconds for that run
+        to finish and raises, or with lock_wait_seconds=0 skips the run right away (status
+        "skipped" in metrics) and returns 0.
+        """
+        metrics = metrics or RunMetrics(data_name)
+        spec = get_dataset(data_name)
+        pool = get_pool(DB_URL)
+        conn = None
+        lock = None
         try:
-            conn = psycopg2.connect(DB_URL)
+            with metrics.stage("db_connect"):
+                conn = pool.getconn()
 
             # Init db for etl
             logger.debug(f"Getting db ready for etl...")
-            dbinit = EtlDbInitializer(conn, data_name)
-            dbinit.init_etl_db()
-            
+            with metrics.stage("init_db"):
+                dbinit = EtlDbInitializer(conn, data_name)
+                dbinit.init_etl_db()
+                conn.commit()
+
+            lock = DatasetLock(conn, data_name)
+            with metrics.stage("lock_wait"):
+                acquired = lock.acquire(lock_wait_seconds)
+            if not acquired:
+                if lock_wait_seconds:
+                    raise Exception(f"{data_name} is still being ingested by another run after waiting {lock_wait_seconds}s")
+                logger.info(f"{data_name} is already being ingested by another run, skipping.")
+                metrics.status = "skipped"
+                return 0
+
+            watermarks = WatermarkStore(conn, data_name)
+            if data_window_hours is None:
+                data_window_hours = spec.default_window_hours
+                if spec.incremental:
+                    data_window_hours = watermarks.window_hours(data_window_hours)
+
+            # The API takes the end of the data window in SGT, whatever the clock of the host is set to
+            now = datetime.now(timezone(SGT_UTC_OFFSET)).strftime('%Y-%m-%d %H:%M:%S')
+
             # Fetch data and store to staging
             logger.info(f"Fetching data for {data_name} with data_window_hours={data_window_hours}...")
-            endpoint = apis[data_name]
+            endpoint = spec.endpoint(now, data_window_hours)
             ingestor = DataFetcher(data_name, endpoint, MDH_API_KEY)
-            ingestor.fetch_and_save(conn)
-            logger.debug(f"Data fetched and stored in raw table for {data_name}.")
-
-            # Transform data and insert into staging table
-            logger.debug(f"Transforming and inserting data for {data_name} into staging...")
-            TRANSFORMERS = {
-                "vessel_arrivals": VesselArrivalsTransformer,
-                "vessel_departures": VesselDeparturesTransformer,
-                "vessels_due_to_arrive": VesselsDueToArriveTransformer,
-            }
-            if data_name not in TRANSFORMERS:
-                raise ValueError(f"No transformer defined for data_name: {data_name}")
-            transformer_class = TRANSFORMERS[data_name]
-            transformer = transformer_class(conn, data_name, location_code_mappings)
-            transformer.transform()
-            logger.debug(f"Data transformed and inserted into staging table for {data_name}.")
-
-            # Load data from staging to final table
-            logger.debug(f"Loading data from staging to final table for {data_name}...")
-            LOADERS = {
-                "vessel_arrivals": MdhVesselArrivalsLoader,
-                "vessel_departures": MdhVesselDeparturesLoader,
-                "vessels_due_to_arrive": MdhVesselsDueToArriveLoader,
-            }
-            loader_class = LOADERS[data_name]
-            loader = loader_class(conn, data_name)
-            num_rows_inserted = loader.load()
-            logger.info(f"{num_rows_inserted} row(s) of new data loaded into final table for {data_name}.")
+            try:
+                with metrics.stage("fetch_and_save"):
+                    ingestor.fetch_and_save(conn)
+            finally:
+                metrics.add_stage_seconds("fetch", ingestor.fetch_seconds)
+                metrics.add("bytes_received", ingestor.bytes_received)
+                metrics.add("payloads_unchanged", int(ingestor.unchanged))
+            logger.debug(f"Data fetched and stored in raw table for {data_name} in {metrics.stage_seconds['fetch_and_save']:.3f}s.")
+
+            # Transform data into staging and load it into the final table, one batch of raw rows
+            # per transaction, so a large backlog of unprocessed rows is worked through in constant memory
+            logger.debug(f"Transforming and loading data for {data_name}...")
+            transformer = MdhDataTransformer(conn, spec, location_code_mappings)
+            loader = MdhDataLoader(conn, spec)
+            num_rows_staged = num_rows_inserted = num_batches = 0
+            with closing(transformer.iter_unprocessed_batches()) as raw_batches:
+                for raw_rows in raw_batches:
+                    with metrics.stage("transform"):
+                        num_batch_rows_staged = transformer.transform_rows(raw_rows)
+                    with metrics.stage("load"):
+                        num_batch_rows_inserted = loader.load() if num_batch_rows_staged else 0
+                        watermarks.advance(loader.max_staged_event_time() if num_batch_rows_staged else None)
+                        conn.commit()
+                    num_rows_staged += num_batch_rows_staged
+                    num_rows_inserted += num_batch_rows_inserted
+                    num_batches += 1
+            metrics.add_stage_seconds("staging_insert", transformer.staging_seconds)
+            metrics.add("records_parsed", transformer.num_records_parsed)
+            metrics.add("records_already_seen", transformer.num_records_seen)
+            metrics.add("rows_staged", num_rows_staged)
+            metrics.add("rows_inserted", num_rows_inserted)
+            metrics.add("rows_skipped", num_rows_staged - num_rows_inserted)
+            metrics.add("raw_batches", num_batches)
+            if not num_batches:
+                logger.debug(f"There are no new api fetches to process for {data_name}.")
+            logger.info(f"{num_rows_inserted} row(s) of new data loaded into final table for {data_name} from {num_batches} batch(es) of raw rows in {metrics.stage_seconds.get('transform', 0) + metrics.stage_seconds.get('load', 0):.3f}s.")
 
-            conn.commit()
+            metrics.status = "success"
             return num_rows_inserted
         except Exception as e:
+            metrics.status = "error"
             msg = f"Error updating data for {data_name}: {e}"
             logger.error(msg)
-            conn.rollback()
+            if conn is not None:
+                conn.rollback()
             traceback.print_exc()
             raise Exception(msg)
         finally:
-            conn.close()
+            if lock is not None:
+                lock.release()
+            if conn is not None:
+                pool.putconn(conn)
+            try:
+                with pool.connection() as metrics_conn:
+                    MetricsRegistry(metrics_conn).record_run(metrics)
+            except Exception as e:
+                logger.warning(f"Error recording the run metrics of {data_name}: {e}")
+            logger.info(f"Run summary: {json.dumps(metrics.as_dict())}")
+
+    def ingest_all(DB_URL, MDH_API_KEY, datasets, location_code_mappings, max_concurrency=None, lock_wait_seconds=0):
+        """
+        Ingest several datasets concurrently, each on its own connection and transaction.
+            datasets: dict of {dataset_name: data_window_hours}, None for an incremental window
+            lock_wait_seconds: see ingest, for datasets already being ingested elsewhere
+        Returns dict of {dataset_name: (num_rows_inserted, error, metrics)}, a failure
+        in one dataset does not affect the others.
+        """
+        max_workers = max(1, min(max_concurrency or MAX_CONCURRENCY, len(datasets) or 1))
+        results = {}
+        run_metrics = {data_name: RunMetrics(data_name) for data_name in datasets}
+        logger.info(f"Ingesting {len(datasets)} dataset(s) with max_concurrency={max_workers}...")
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest") as executor:
+            futures = {
+                executor.submit(MdhApiIngestor.ingest, DB_URL, MDH_API_KEY, data_name, data_window_hours, location_code_mappings, run_metrics[data_name], lock_wait_seconds): data_name
+                for data_name, data_window_hours in datasets.items()
+            }
+            for future in as_completed(futures):
+                data_name = futures[future]
+                try:
+                    results[data_name] = (future.result(), None, run_metrics[data_name])
+                except Exception as e:
+                    results[data_name] = (None, e, run_metrics[data_name])
+        return {data_name: results[data_name] for data_name in datasets}
+
+    def compact_raw(DB_URL, data_name, retention_days, archive=False):
+        """
+        Drop or archive processed raw.<data_name> partitions older than retention_days and
+        remove the dataset's changes and record hashes older than their retention.
+        Returns the names of the partitions removed.
+        """
+        with get_pool(DB_URL).connection() as conn:
+            try:
+                EtlDbInitializer(conn, data_name).init_etl_db()
+                removed = RawPartitionManager(conn, data_name).compact(retention_days, archive)
+                num_changes_pruned = ChangeFeed(conn).prune(data_name)
+                if num_changes_pruned:
+                    logger.info(f"Pruned {num_changes_pruned} change(s) of {data_name} from etl.changes.")
+                num_hashes_pruned = RecordHashStore(conn, data_name).prune()
+                if num_hashes_pruned:
+                    logger.info(f"Pruned {num_hashes_pruned} record hash(es) of {data_name} from etl.record_hashes.")
+                conn.commit()
+                return removed
+            except Exception as e:
+                msg = f"Error compacting raw data for {data_name}: {e}"
+                logger.error(msg)
+                conn.rollback()
+                raise Exception(msg)
+
+    def export(DB_URL, data_name, uri=None, compact=False):
+        """
+        Export the rows loaded into public.<data_name> since the last export to Parquet under uri
+        (ETL_EXPORT_URI by default), then merge small files if compact. Skipped if the dataset is
+        being exported elsewhere. Returns the number of rows exported.
+        """
+        uri = uri or EXPORT_URI
+        if not uri:
+            raise Exception("No export location given, set ETL_EXPORT_URI.")
+        with get_pool(DB_URL).connection() as conn:
+            lock = DatasetLock(conn, data_name, "etl_export")
+            try:
+                EtlDbInitializer(conn, data_name).init_etl_db()
+                conn.commit()
+                if not lock.try_acquire():
+                    logger.info(f"{data_name} is already being exported by another run, skipping.")
+                    return 0
+                fs, root = open_export_root(uri, data_name)
+                exporter = ParquetExporter(conn, get_dataset(data_name), fs, root)
+                num_rows = exporter.export()
+                logger.info(f"Exported {num_rows} row(s) of {data_name} up to change {exporter.manifest.last_seq} to {root}.")
+                if compact:
+                    num_files_removed = exporter.compact()
+                    logger.info(f"Compacted the export of {data_name}, {num_files_removed} file(s) removed, {len(exporter.manifest.files)} left.")
+                conn.commit()
+                return num_rows
+            except Exception as e:
+                msg = f"Error exporting {data_name}: {e}"
+                logger.error(msg)
+                conn.rollback()
+                raise Exception(msg)
+            finally:
+                lock.release()
+
+    def backfill(DB_URL, MDH_API_KEY, data_names, start, end, location_code_mappings, chunk_hours=None, max_concurrency=None):
+        """
+        Backfill each dataset in turn between start and end (naive SGT datetimes).
+        Returns dict of {dataset_name: summary}, see BackfillRunner.run.
+        """
+        results = {}
+        for data_name in data_names:
+            runner = BackfillRunner(DB_URL, MDH_API_KEY, data_name, start, end, location_code_mappings, chunk_hours, max_concurrency)
+            results[data_name] = runner.run()
+        return results
+
+    def replay(DB_URL, data_names, start, end, location_code_mappings, shadow_schema=None, chunk_hours=None,
+               max_concurrency=None, reset_shadow=False):
+        """
+        Replay the raw rows of each dataset in turn fetched between start and end, into the final
+        tables or <shadow_schema>.<data_name>. Returns dict of {dataset_name: summary}, see ReplayRunner.run.
+        """
+        results = {}
+        for data_name in data_names:
+            runner = ReplayRunner(DB_URL, data_name, start, end, location_code_mappings, shadow_schema, chunk_hours,
+                                  max_concurrency, reset_shadow)
+            results[data_name] = runner.run()
+        return results
\ No newline at end of file
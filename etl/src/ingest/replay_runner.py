@@ -0,0 +1,185 @@
+import re
+import traceback
+import etl.src.util.env as env
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import timedelta, timezone
+from psycopg2 import sql
+from etl.src.datasets import get_dataset
+from etl.src.ingest.dataset_lock import DATASET_LOCK_WAIT_SECONDS, DatasetLock
+from etl.src.init_db import EtlDbInitializer
+from etl.src.load import LIVE_SCHEMA, MdhDataLoader
+from etl.src.transform import MdhDataTransformer
+from etl.src.transform.mdh_data_transformer import SGT_UTC_OFFSET
+from etl.src.util.db import get_pool
+from etl.src.util.logger import logger
+
+# Hours of fetched_at replayed per chunk
+REPLAY_CHUNK_HOURS = env.optional_env_int("ETL_REPLAY_CHUNK_HOURS", 24)
+# Max number of replay chunks of a dataset run at the same time
+REPLAY_MAX_CONCURRENCY = env.optional_env_int("ETL_REPLAY_MAX_CONCURRENCY", 4)
+# Shadow schema names accepted, plain lowercase identifiers
+SHADOW_SCHEMA_PATTERN = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+
+def validate_shadow_schema(shadow_schema):
+    if not SHADOW_SCHEMA_PATTERN.match(shadow_schema):
+        raise ValueError(f"Invalid shadow schema {shadow_schema!r}, expected lowercase letters, digits and underscores.")
+    if shadow_schema == LIVE_SCHEMA:
+        raise ValueError("The shadow schema must not be the schema of the final tables.")
+    return shadow_schema
+
+
+class ReplayRunner:
+    """
+    Transforms and loads again the raw rows of a dataset fetched between start and end (naive
+    datetimes are SGT), processed or not, without calling MDH. The range is split into chunk_hours
+    windows run in parallel, each on its own connection and committing every batch of raw rows.
+    Into the live tables, rows missing from the final table are inserted like in a normal load and
+    ingestions of the dataset wait for the replay: rows already loaded are left as they are, even if
+    they differ, so a live replay only fills gaps. Into a shadow schema, rows go to
+    <shadow_schema>.<data_name>, created like the final table, and raw rows are left untouched.
+    Only raw.<data_name> is replayed, partitions moved to raw_archive are not.
+    """
+    def __init__(self, DB_URL, data_name, start, end, location_code_mappings=None, shadow_schema=None,
+                 chunk_hours=None, max_concurrency=None, reset_shadow=False):
+        self.DB_URL = DB_URL
+        self.spec = get_dataset(data_name)
+        self.data_name = data_name
+        self.start = start if start.tzinfo else start.replace(tzinfo=timezone(SGT_UTC_OFFSET))
+        self.end = end if end.tzinfo else end.replace(tzinfo=timezone(SGT_UTC_OFFSET))
+        self.location_code_mappings = location_code_mappings
+        self.schema = validate_shadow_schema(shadow_schema) if shadow_schema else LIVE_SCHEMA
+        self.shadow_table = sql.Identifier(self.schema, self.data_name)
+        self.chunk_hours = chunk_hours or REPLAY_CHUNK_HOURS
+        self.max_concurrency = max_concurrency or REPLAY_MAX_CONCURRENCY
+        self.reset_shadow = reset_shadow
+        if self.start >= self.end:
+            raise ValueError(f"Replay start {start} must be before end {end}.")
+        if self.chunk_hours < 1:
+            raise ValueError("Replay chunk_hours must be at least 1.")
+
+    @property
+    def live(self):
+        return self.schema == LIVE_SCHEMA
+
+    def windows(self):
+        windows = []
+        window_start = self.start
+        while window_start < self.end:
+            window_end = min(window_start + timedelta(hours=self.chunk_hours), self.end)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        return windows
+
+    def init_shadow_table(self, conn):
+        with conn.cursor() as cur:
+            if self.reset_shadow:
+                cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(self.shadow_table))
+            cur.execute(
+                sql.SQL(
+                    """
+                    CREATE SCHEMA IF NOT EXISTS {schema};
+                    CREATE TABLE IF NOT EXISTS {table}
+                    (LIKE {live_table} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)
+                    """
+                ).format(
+                    schema=sql.Identifier(self.schema),
+                    table=self.shadow_table,
+                    live_table=sql.Identifier(LIVE_SCHEMA, self.data_name),
+                )
+            )
+
+    def run_chunk(self, window):
+        window_start, window_end = window
+        with get_pool(self.DB_URL).connection() as conn:
+            transformer = MdhDataTransformer(conn, self.spec, self.location_code_mappings, skip_seen_records=False,
+                                             mark_processed=self.live)
+            loader = MdhDataLoader(conn, self.spec, self.schema)
+            num_raw_rows = num_rows_staged = num_rows_inserted = 0
+            try:
+                with closing(transformer.iter_fetched_batches(window_start, window_end)) as raw_batches:
+                    for raw_rows in raw_batches:
+                        num_batch_rows_staged = transformer.transform_rows(raw_rows)
+                        num_rows_inserted += loader.load() if num_batch_rows_staged else 0
+                        conn.commit()
+                        num_raw_rows += len(raw_rows)
+                        num_rows_staged += num_batch_rows_staged
+                logger.info(f"Replayed {self.data_name} fetched {window_start} - {window_end} into {loader.table}: {num_rows_inserted} of {num_rows_staged} row(s) from {num_raw_rows} raw row(s) inserted.")
+                return {"error": None, "raw_rows": num_raw_rows, "rows_staged": num_rows_staged, "rows_inserted": num_rows_inserted}
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error replaying {self.data_name} fetched {window_start} - {window_end}: {e}")
+                traceback.print_exc()
+                return {"error": str(e), "raw_rows": num_raw_rows, "rows_staged": num_rows_staged, "rows_inserted": num_rows_inserted}
+
+    def diff(self, conn):
+        """
+        Compare the shadow table with the final table, matching rows on the dataset's record identifier
+        columns and comparing the other fields, fetched_at is left out as it depends on the raw row loaded.
+        """
+        identifiers = " AND ".join(f"s.{column} = l.{column}" for column in self.spec.identifier_columns)
+        compared = [column for column in self.spec.fields if column not in self.spec.identifier_columns]
+        differs = " OR ".join(f"s.{column} IS DISTINCT FROM l.{column}" for column in compared) or "false"
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    f"""
+                    SELECT count(*),
+                           count(*) FILTER (WHERE l.ctid IS NULL),
+                           count(*) FILTER (WHERE l.ctid IS NOT NULL AND ({differs}))
+                    FROM {{table}} s
+                    LEFT JOIN public.{self.data_name} l ON {identifiers}
+                    """
+                ).format(table=self.shadow_table)
+            )
+            num_rows, num_missing, num_different = cur.fetchone()
+        return {"shadow_rows": num_rows, "missing_from_live": num_missing, "different_from_live": num_different}
+
+    def replay_chunks(self, windows):
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix=f"replay-{self.data_name}") as executor:
+            return list(executor.map(self.run_chunk, windows))
+
+    def run(self):
+        """Returns a summary of the chunks replayed, failed chunks can be replayed again on their own."""
+        pool = get_pool(self.DB_URL)
+        with pool.connection() as conn:
+            EtlDbInitializer(conn, self.data_name).init_etl_db()
+            if not self.live:
+                self.init_shadow_table(conn)
+                # Created once up front, rather than raced for by the chunks, the final table's is created by migrations
+                MdhDataLoader(conn, self.spec, self.schema).ensure_unique_index()
+            conn.commit()
+
+            windows = self.windows()
+            logger.info(f"Replaying {self.data_name} fetched from {self.start} to {self.end} into {self.schema}: {len(windows)} chunk(s) of {self.chunk_hours}h, max_concurrency={self.max_concurrency}...")
+            if self.live:
+                # Hold the dataset's ingestion lock, so scheduled runs do not load the same raw rows meanwhile
+                lock = DatasetLock(conn, self.data_name)
+                if not lock.acquire(DATASET_LOCK_WAIT_SECONDS):
+                    raise Exception(f"{self.data_name} is still being ingested by another run after waiting {DATASET_LOCK_WAIT_SECONDS}s")
+                try:
+                    outcomes = self.replay_chunks(windows)
+                finally:
+                    lock.release()
+            else:
+                outcomes = self.replay_chunks(windows)
+
+            failed = [
+                {"window_start": str(window[0]), "window_end": str(window[1]), "error": outcome["error"]}
+                for window, outcome in zip(windows, outcomes) if outcome["error"]
+            ]
+            summary = {
+                "data_name": self.data_name,
+                "schema": self.schema,
+                "chunks": len(windows),
+                "failed": failed,
+                "raw_rows": sum(outcome["raw_rows"] for outcome in outcomes),
+                "rows_staged": sum(outcome["rows_staged"] for outcome in outcomes),
+                "rows_inserted": sum(outcome["rows_inserted"] for outcome in outcomes),
+            }
+            if not self.live:
+                summary.update(self.diff(conn))
+                conn.commit()
+            return summary
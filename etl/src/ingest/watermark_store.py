@@ -0,0 +1,49 @@
+import math
+import etl.src.util.env as env
+
+# Hours of already-loaded data fetched again on every incremental run, to pick up late records
+WATERMARK_OVERLAP_HOURS = env.optional_env_int("ETL_WATERMARK_OVERLAP_HOURS", 2)
+
+class WatermarkStore:
+    """Per-dataset high-water mark: the latest event time successfully loaded into the final table."""
+    def __init__(self, conn, data_name):
+        self.conn = conn
+        self.data_name = data_name
+
+    def seconds_since_high_water_mark(self):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT extract(epoch FROM now() - high_water_mark)
+                FROM etl.watermarks
+                WHERE data_name = %s
+                """,
+                (self.data_name,)
+            )
+            row = cur.fetchone()
+            return float(row[0]) if row else None
+
+    def window_hours(self, default_window_hours, overlap_hours=WATERMARK_OVERLAP_HOURS):
+        """
+        Smallest data window covering everything since the high-water mark plus the overlap,
+        capped at the default window. Falls back to the default window on the first run.
+        """
+        seconds = self.seconds_since_high_water_mark()
+        if seconds is None:
+            return default_window_hours
+        return max(1, min(default_window_hours, math.ceil(max(seconds, 0) / 3600) + overlap_hours))
+
+    def advance(self, high_water_mark):
+        if high_water_mark is None:
+            return
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO etl.watermarks (data_name, high_water_mark, updated_at)
+                VALUES (%s, LEAST(%s, now()), now())
+                ON CONFLICT (data_name) DO UPDATE SET
+                    high_water_mark = GREATEST(etl.watermarks.high_water_mark, EXCLUDED.high_water_mark),
+                    updated_at = now()
+                """,
+                (self.data_name, high_water_mark)
+            )
@@ -1 +1,2 @@
-from .etl_db_initializer import EtlDbInitializer
\ No newline at end of file
+from .etl_db_initializer import EtlDbInitializer
+from .raw_partition_manager import RawPartitionManager
\ No newline at end of file
@@ -1,78 +1,216 @@
+import threading
+
+from etl.src.datasets import get_dataset
+from etl.src.init_db.raw_partition_manager import RawPartitionManager
+from etl.src.load.mdh_data_loader import MdhDataLoader
+from etl.src.load.vessel_status import VesselStatus
+from etl.src.util.db import lock_schema_changes
+from etl.src.util.logger import logger
+
+# Bump whenever the DDL run by migrate() changes, so databases initialized by an older version get it applied again.
+# Staging tables are temporary, created on each connection from the registry, and need no bump when their columns change.
+ETL_SCHEMA_VERSION = 11
+
+# (data_name, schema version) pairs this process has already seen applied
+_applied_versions = set()
+_applied_versions_lock = threading.Lock()
+
+
 class EtlDbInitializer:
     def __init__(self, conn, data_name):
         self.conn = conn
         self.data_name = data_name
+        self.spec = get_dataset(data_name)
+
+    @property
+    def schema_version(self):
+        return str(ETL_SCHEMA_VERSION)
 
     def init_raw(self):
+        with self.conn.cursor() as cur:
+            cur.execute("CREATE SCHEMA IF NOT EXISTS raw")
+        RawPartitionManager(self.conn, self.data_name).init_table()
+
+    def init_staging(self):
+        # Runs stage into per-connection temporary tables, the table that used to be shared by every run is dropped
+        with self.conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS staging.{self.data_name}")
+
+    def init_etl_metadata(self):
         with self.conn.cursor() as cur:
             cur.execute(
-                f"""
-                CREATE SCHEMA IF NOT EXISTS raw;
-                CREATE TABLE IF NOT EXISTS "raw".{self.data_name}
+                """
+                CREATE SCHEMA IF NOT EXISTS etl;
+                CREATE TABLE IF NOT EXISTS etl.watermarks
+                (
+                    data_name text COLLATE pg_catalog."default" PRIMARY KEY,
+                    high_water_mark timestamp with time zone NOT NULL,
+                    updated_at timestamp with time zone NOT NULL DEFAULT now()
+                );
+                CREATE TABLE IF NOT EXISTS etl.schema_versions
+                (
+                    data_name text COLLATE pg_catalog."default" PRIMARY KEY,
+                    version text COLLATE pg_catalog."default" NOT NULL,
+                    applied_at timestamp with time zone NOT NULL DEFAULT now()
+                );
+                CREATE TABLE IF NOT EXISTS etl.backfill_chunks
+                (
+                    data_name text COLLATE pg_catalog."default" NOT NULL,
+                    window_start timestamp without time zone NOT NULL,
+                    window_end timestamp without time zone NOT NULL,
+                    status text COLLATE pg_catalog."default" NOT NULL,
+                    raw_id bigint,
+                    rows_staged integer,
+                    rows_inserted integer,
+                    error text COLLATE pg_catalog."default",
+                    attempts integer NOT NULL DEFAULT 0,
+                    updated_at timestamp with time zone NOT NULL DEFAULT now(),
+                    PRIMARY KEY (data_name, window_start, window_end)
+                );
+                CREATE TABLE IF NOT EXISTS etl.changes
+                (
+                    seq bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                    data_name text COLLATE pg_catalog."default" NOT NULL,
+                    op text COLLATE pg_catalog."default" NOT NULL,
+                    row_data jsonb NOT NULL,
+                    created_at timestamp with time zone NOT NULL DEFAULT now()
+                );
+                CREATE INDEX IF NOT EXISTS changes_data_name_seq_idx ON etl.changes (data_name, seq);
+                CREATE INDEX IF NOT EXISTS changes_created_at_idx ON etl.changes (created_at);
+                CREATE TABLE IF NOT EXISTS etl.record_hashes
+                (
+                    data_name text COLLATE pg_catalog."default" NOT NULL,
+                    record_hash uuid NOT NULL,
+                    first_seen_at timestamp with time zone NOT NULL DEFAULT now(),
+                    PRIMARY KEY (data_name, record_hash)
+                );
+                CREATE INDEX IF NOT EXISTS record_hashes_first_seen_at_idx ON etl.record_hashes (first_seen_at);
+                CREATE TABLE IF NOT EXISTS etl.exports
                 (
-                    id integer PRIMARY KEY GENERATED ALWAYS AS IDENTITY ( INCREMENT 1 START 1 MINVALUE 1 CACHE 1 ),
-                    endpoint text COLLATE pg_catalog."default" NOT NULL,
-                    fetched_at timestamp with time zone DEFAULT now(),
-                    status_code integer,
-                    response_json jsonb,
-                    details text COLLATE pg_catalog."default",
-                    processed boolean NOT NULL DEFAULT false
+                    data_name text COLLATE pg_catalog."default" PRIMARY KEY,
+                    last_seq bigint NOT NULL,
+                    updated_at timestamp with time zone NOT NULL DEFAULT now()
+                );
+                CREATE TABLE IF NOT EXISTS etl.run_metrics
+                (
+                    data_name text COLLATE pg_catalog."default" NOT NULL,
+                    kind text COLLATE pg_catalog."default" NOT NULL,
+                    name text COLLATE pg_catalog."default" NOT NULL,
+                    value double precision NOT NULL,
+                    count bigint NOT NULL,
+                    updated_at timestamp with time zone NOT NULL DEFAULT now(),
+                    PRIMARY KEY (data_name, kind, name)
                 )
                 """
             )
-            
-    def init_staging(self):
+        VesselStatus(self.conn).init_table()
+
+    def init_reference(self):
+        # Location codes cached by etl.src.extract.location_code_cache, shared by every dataset
         with self.conn.cursor() as cur:
-            if self.data_name == "vessel_arrivals":
-                cur.execute(
-                    f"""
-                    CREATE SCHEMA IF NOT EXISTS staging;
-                    CREATE TABLE IF NOT EXISTS "staging".{self.data_name}
-                    (
-                        id integer PRIMARY KEY GENERATED ALWAYS AS IDENTITY ( INCREMENT 1 START 1 MINVALUE 1 CACHE 1 ),
-                        vessel_name text COLLATE pg_catalog."default",
-                        callsign text COLLATE pg_catalog."default",
-                        imo text COLLATE pg_catalog."default",
-                        flag text COLLATE pg_catalog."default",
-                        arrived_time timestamp with time zone,
-                        location_from text COLLATE pg_catalog."default",
-                        location_to text COLLATE pg_catalog."default",
-                        fetched_at timestamp with time zone
-                    )
-                    """)
-            elif self.data_name == "vessel_departures": 
-                cur.execute(
-                    f"""
-                    CREATE SCHEMA IF NOT EXISTS staging;
-                    CREATE TABLE IF NOT EXISTS "staging".{self.data_name}
-                    (
-                        id integer PRIMARY KEY GENERATED ALWAYS AS IDENTITY ( INCREMENT 1 START 1 MINVALUE 1 CACHE 1 ),
-                        vessel_name text COLLATE pg_catalog."default",
-                        callsign text COLLATE pg_catalog."default",
-                        imo text COLLATE pg_catalog."default",
-                        flag text COLLATE pg_catalog."default",
-                        departed_time timestamp with time zone,
-                        fetched_at timestamp with time zone
-                    )
-                    """)
-            elif self.data_name == "vessels_due_to_arrive": 
-                cur.execute(
-                    f"""
-                    CREATE SCHEMA IF NOT EXISTS staging;
-                    CREATE TABLE IF NOT EXISTS "staging".{self.data_name}
-                    (
-                        id integer PRIMARY KEY GENERATED ALWAYS AS IDENTITY ( INCREMENT 1 START 1 MINVALUE 1 CACHE 1 ),
-                        vessel_name text COLLATE pg_catalog."default",
-                        callsign text COLLATE pg_catalog."default",
-                        imo text COLLATE pg_catalog."default",
-                        flag text COLLATE pg_catalog."default",
-                        due_to_arrive_time timestamp with time zone,
-                        location_from text COLLATE pg_catalog."default",
-                        location_to text COLLATE pg_catalog."default",
-                        fetched_at timestamp with time zone
-                    )
-                    """)
-    
+            cur.execute(
+                """
+                CREATE SCHEMA IF NOT EXISTS reference;
+                CREATE TABLE IF NOT EXISTS reference.location_codes
+                (
+                    location_description text COLLATE pg_catalog."default" PRIMARY KEY,
+                    location_code text COLLATE pg_catalog."default" NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS reference.location_codes_meta
+                (
+                    id integer PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                    etag text COLLATE pg_catalog."default",
+                    last_modified text COLLATE pg_catalog."default",
+                    refreshed_at timestamp with time zone,
+                    checked_at timestamp with time zone
+                )
+                """
+            )
+
+    def init_jobs(self):
+        # Queue of etl.src.jobs.ingestion_job_queue, shared by every dataset
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS etl.ingestion_jobs
+                (
+                    id bigint PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                    kind text COLLATE pg_catalog."default" NOT NULL,
+                    params jsonb NOT NULL,
+                    dedupe_key text COLLATE pg_catalog."default" NOT NULL,
+                    status text COLLATE pg_catalog."default" NOT NULL DEFAULT 'pending',
+                    results jsonb,
+                    error text COLLATE pg_catalog."default",
+                    attempts integer NOT NULL DEFAULT 0,
+                    created_at timestamp with time zone NOT NULL DEFAULT now(),
+                    started_at timestamp with time zone,
+                    heartbeat_at timestamp with time zone,
+                    finished_at timestamp with time zone
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS ingestion_jobs_pending_dedupe_key_idx
+                    ON etl.ingestion_jobs (dedupe_key) WHERE status = 'pending';
+                CREATE INDEX IF NOT EXISTS ingestion_jobs_active_idx
+                    ON etl.ingestion_jobs (created_at) WHERE status IN ('pending', 'running');
+                """
+            )
+
+    def applied_version(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('etl.schema_versions')")
+            if cur.fetchone()[0] is None:
+                return None
+            cur.execute("SELECT version FROM etl.schema_versions WHERE data_name = %s", (self.data_name,))
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def record_version(self, version):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO etl.schema_versions (data_name, version)
+                VALUES (%s, %s)
+                ON CONFLICT (data_name) DO UPDATE SET version = EXCLUDED.version, applied_at = now()
+                """,
+                (self.data_name, version)
+            )
+
+    def migrate(self):
+        """
+        Run the DDL for the dataset and record the schema version, committing it right away.
+        Returns whether the current version is recorded, it is not while public.<dataset> is missing.
+        """
+        version = self.schema_version
+        lock_schema_changes(self.conn)
+        # Another process may have applied it while we were waiting for the lock
+        applied = self.applied_version()
+        if applied != version:
+            logger.info(f"Migrating ETL schema of {self.data_name} from version {applied} to {version}...")
+            self.init_raw()
+            self.init_staging()
+            self.init_etl_metadata()
+            self.init_reference()
+            self.init_jobs()
+            # Catch up on the rows loaded before etl.vessel_status had the dataset's columns
+            VesselStatus(self.conn).rebuild(self.spec)
+            if MdhDataLoader(self.conn, self.spec).ensure_unique_index():
+                self.record_version(version)
+                applied = version
+            else:
+                # Loads need the index, so migrate again once the web server has created the table
+                logger.warning(f"public.{self.data_name} does not exist yet, its unique index will be created by a later migration.")
+        self.conn.commit()
+        return applied == version
+
     def init_etl_db(self):
-        self.init_raw()
-        self.init_staging()
\ No newline at end of file
+        """
+        Make sure the dataset's tables exist. DDL only runs when the schema version recorded in
+        etl.schema_versions differs from the current one, and once it is recorded the version is not
+        looked up again by this process. Upcoming raw partitions are still created as the days go by.
+        """
+        key = (self.data_name, self.schema_version)
+        with _applied_versions_lock:
+            known = key in _applied_versions
+        if not known and (self.applied_version() == self.schema_version or self.migrate()):
+            with _applied_versions_lock:
+                _applied_versions.add(key)
+        RawPartitionManager(self.conn, self.data_name).ensure_partitions()
@@ -0,0 +1,231 @@
+import etl.src.util.env as env
+
+from datetime import datetime, timedelta, timezone
+from etl.src.util.db import lock_schema_changes
+from etl.src.util.logger import logger
+
+# Processed raw partitions older than this many days are dropped or archived by compact()
+RAW_RETENTION_DAYS = env.optional_env_int("RAW_RETENTION_DAYS", 30)
+# Schema that detached partitions are moved to when archiving instead of dropping
+RAW_ARCHIVE_SCHEMA = "raw_archive"
+
+
+class RawPartitionManager:
+    """
+    Manages raw.<data_name> as a table range-partitioned by day on fetched_at (UTC):
+    creating it (migrating an older unpartitioned table), creating upcoming partitions,
+    and compacting old ones.
+    """
+    def __init__(self, conn, data_name):
+        self.conn = conn
+        self.data_name = data_name
+
+    def partition_name(self, day):
+        return f"{self.data_name}_p{day:%Y%m%d}"
+
+    def partition_day(self, partition_name):
+        suffix = partition_name[len(self.data_name) + 2:]
+        try:
+            return datetime.strptime(suffix, "%Y%m%d").replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+
+    def table_kind(self):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.relkind
+                FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'raw' AND c.relname = %s
+                """,
+                (self.data_name,)
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+
+    def create_partitioned_table(self):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS "raw".{self.data_name}
+                (
+                    id bigserial,
+                    endpoint text COLLATE pg_catalog."default" NOT NULL,
+                    fetched_at timestamp with time zone NOT NULL DEFAULT now(),
+                    status_code integer,
+                    response_json jsonb,
+                    details text COLLATE pg_catalog."default",
+                    processed boolean NOT NULL DEFAULT false,
+                    payload_hash bytea,
+                    PRIMARY KEY (id, fetched_at)
+                ) PARTITION BY RANGE (fetched_at);
+                CREATE TABLE IF NOT EXISTS "raw".{self.data_name}_default PARTITION OF "raw".{self.data_name} DEFAULT;
+                CREATE INDEX IF NOT EXISTS {self.data_name}_unprocessed_idx
+                    ON "raw".{self.data_name} (fetched_at)
+                    WHERE status_code = 200 AND processed = false;
+                """
+            )
+
+    def create_partition(self, day):
+        name = self.partition_name(day)
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS "raw".{name}
+                PARTITION OF "raw".{self.data_name}
+                FOR VALUES FROM (%s) TO (%s)
+                """,
+                (day, day + timedelta(days=1))
+            )
+
+    def missing_partitions(self, names):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT name FROM unnest(%s::text[]) AS name
+                WHERE to_regclass('"raw".' || quote_ident(name)) IS NULL
+                """,
+                (names,)
+            )
+            return [row[0] for row in cur.fetchall()]
+
+    def ensure_partitions(self, days_ahead=1):
+        """
+        Create the partitions for today and the next days_ahead days (UTC) that do not exist yet.
+        Once they exist this is a single catalog lookup, no DDL is run.
+        """
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        days = {self.partition_name(day): day for day in (today + timedelta(days=offset) for offset in range(days_ahead + 1))}
+        missing = self.missing_partitions(list(days))
+        if missing:
+            lock_schema_changes(self.conn)
+            for name in missing:
+                self.create_partition(days[name])
+            logger.info(f"Created raw partition(s) {missing}.")
+
+    def migrate_unpartitioned(self):
+        """Move an existing unpartitioned raw.<data_name> into a new partitioned table."""
+        legacy = f"{self.data_name}_legacy"
+        logger.info(f"Migrating raw.{self.data_name} to a partitioned table...")
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"""
+                ALTER TABLE "raw".{self.data_name} RENAME TO {legacy};
+                ALTER SEQUENCE IF EXISTS "raw".{self.data_name}_id_seq RENAME TO {legacy}_id_seq;
+                ALTER INDEX IF EXISTS "raw".{self.data_name}_pkey RENAME TO {legacy}_pkey;
+                """
+            )
+            self.create_partitioned_table()
+            cur.execute(
+                f"""
+                SELECT DISTINCT date_trunc('day', COALESCE(fetched_at, now()), 'UTC')
+                FROM "raw".{legacy}
+                """
+            )
+            for (day,) in cur.fetchall():
+                self.create_partition(day.astimezone(timezone.utc))
+            cur.execute(
+                f"""
+                INSERT INTO "raw".{self.data_name}
+                    (id, endpoint, fetched_at, status_code, response_json, details, processed)
+                SELECT id, endpoint, COALESCE(fetched_at, now()), status_code, response_json, details, processed
+                FROM "raw".{legacy}
+                """
+            )
+            num_rows_migrated = cur.rowcount
+            cur.execute(
+                f"""
+                SELECT setval(pg_get_serial_sequence('"raw".{self.data_name}', 'id'), (SELECT max(id) FROM "raw".{legacy}))
+                WHERE EXISTS (SELECT 1 FROM "raw".{legacy});
+                DROP TABLE "raw".{legacy};
+                """
+            )
+            logger.info(f"Migrated {num_rows_migrated} row(s) into partitioned raw.{self.data_name}.")
+
+    def add_payload_hash(self):
+        """Add the payload hash to tables created before it existed, with the index used to find processed payloads by hash."""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"""
+                ALTER TABLE "raw".{self.data_name} ADD COLUMN IF NOT EXISTS payload_hash bytea;
+                CREATE INDEX IF NOT EXISTS {self.data_name}_payload_hash_idx
+                    ON "raw".{self.data_name} (payload_hash)
+                    WHERE status_code = 200 AND processed = true;
+                """
+            )
+
+    def init_table(self):
+        kind = self.table_kind()
+        if kind is None:
+            self.create_partitioned_table()
+        elif kind == "r":
+            self.migrate_unpartitioned()
+        self.add_payload_hash()
+        self.ensure_partitions()
+
+    def list_partitions(self):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.relname
+                FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = to_regclass(%s)
+                ORDER BY c.relname
+                """,
+                (f"raw.{self.data_name}",)
+            )
+            return [row[0] for row in cur.fetchall()]
+
+    def has_unprocessed_rows(self, partition):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT EXISTS (
+                    SELECT 1 FROM "raw".{partition}
+                    WHERE status_code = 200 AND processed = false
+                )
+                """
+            )
+            return cur.fetchone()[0]
+
+    def compact(self, retention_days=RAW_RETENTION_DAYS, archive=False):
+        """
+        Drop (or, with archive=True, detach and move to the raw_archive schema) every daily
+        partition that ended more than retention_days ago and whose rows are all processed,
+        then delete old processed rows from the default partition.
+        Returns the names of the partitions removed.
+        """
+        cutoff = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=retention_days)
+        removed = []
+        with self.conn.cursor() as cur:
+            if archive:
+                cur.execute(f"CREATE SCHEMA IF NOT EXISTS {RAW_ARCHIVE_SCHEMA}")
+            for partition in self.list_partitions():
+                day = self.partition_day(partition)
+                if day is None or day + timedelta(days=1) > cutoff:
+                    continue
+                if self.has_unprocessed_rows(partition):
+                    logger.warning(f"Keeping raw.{partition}: it still has unprocessed rows.")
+                    continue
+                if archive:
+                    cur.execute(
+                        f"""
+                        ALTER TABLE "raw".{self.data_name} DETACH PARTITION "raw".{partition};
+                        ALTER TABLE "raw".{partition} SET SCHEMA {RAW_ARCHIVE_SCHEMA};
+                        """
+                    )
+                else:
+                    cur.execute(f'DROP TABLE "raw".{partition}')
+                removed.append(partition)
+            cur.execute(
+                f"""
+                DELETE FROM "raw".{self.data_name}_default
+                WHERE fetched_at < %s
+                AND NOT (status_code = 200 AND processed = false)
+                """,
+                (cutoff,)
+            )
+            num_default_rows_deleted = cur.rowcount
+        action = "Archived" if archive else "Dropped"
+        logger.info(f"{action} {len(removed)} raw partition(s) for {self.data_name} older than {retention_days} day(s), deleted {num_default_rows_deleted} old row(s) from the default partition.")
+        return removed
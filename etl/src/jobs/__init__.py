@@ -0,0 +1,3 @@
+from .ingestion_job_queue import IngestionJobQueue
+from .ingestion_job_worker import IngestionJobWorker
+from .ingestion_scheduler import IngestionScheduler
\ No newline at end of file
@@ -0,0 +1,116 @@
+import json
+import etl.src.util.env as env
+
+from psycopg2.extras import Json, RealDictCursor
+from etl.src.util.logger import logger
+
+# Running jobs whose heartbeat is older than this are considered abandoned and picked up again
+JOB_LEASE_SECONDS = env.optional_env_int("ETL_JOB_LEASE_SECONDS", 300)
+# Jobs are marked failed once they have been claimed this many times
+JOB_MAX_ATTEMPTS = env.optional_env_int("ETL_JOB_MAX_ATTEMPTS", 3)
+
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class IngestionJobQueue:
+    """
+    Ingestion jobs persisted in etl.ingestion_jobs, so they survive restarts and can be polled.
+    The table is created by the ETL schema migration, see EtlDbInitializer.init_jobs.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def enqueue(self, kind, params):
+        """
+        Add a pending job, or return the identical job already pending.
+        Returns (job_id, created).
+        """
+        dedupe_key = f"{kind}:{json.dumps(params, sort_keys=True)}"
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO etl.ingestion_jobs (kind, params, dedupe_key)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (dedupe_key) WHERE status = 'pending' DO NOTHING
+                RETURNING id
+                """,
+                (kind, Json(params), dedupe_key)
+            )
+            row = cur.fetchone()
+            created = row is not None
+            if not created:
+                cur.execute(
+                    "SELECT id FROM etl.ingestion_jobs WHERE dedupe_key = %s AND status = 'pending'",
+                    (dedupe_key,)
+                )
+                row = cur.fetchone()
+        self.conn.commit()
+        if row is None:
+            # The identical pending job was claimed in between, enqueue a fresh one
+            return self.enqueue(kind, params)
+        return row[0], created
+
+    def claim(self):
+        """Mark the oldest available job as running and return it, or None if there is none."""
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                UPDATE etl.ingestion_jobs
+                SET status = 'running', started_at = now(), heartbeat_at = now(), attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM etl.ingestion_jobs
+                    WHERE status = 'pending'
+                    OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => %s))
+                    ORDER BY created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, kind, params, attempts
+                """,
+                (JOB_LEASE_SECONDS,)
+            )
+            job = cur.fetchone()
+        self.conn.commit()
+        if job is not None and job["attempts"] > JOB_MAX_ATTEMPTS:
+            logger.warning(f"Ingestion job {job['id']} abandoned after {JOB_MAX_ATTEMPTS} attempt(s).")
+            self.finish(job["id"], FAILED, None, f"Abandoned after {JOB_MAX_ATTEMPTS} attempt(s).")
+            return self.claim()
+        return job
+
+    def heartbeat(self, job_id):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "UPDATE etl.ingestion_jobs SET heartbeat_at = now() WHERE id = %s AND status = 'running'",
+                (job_id,)
+            )
+        self.conn.commit()
+
+    def finish(self, job_id, status, results, error=None):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE etl.ingestion_jobs
+                SET status = %s, results = %s, error = %s, finished_at = now()
+                WHERE id = %s
+                """,
+                (status, Json(results) if results is not None else None, error, job_id)
+            )
+        self.conn.commit()
+
+    def get(self, job_id):
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT id, kind, params, status, results, error, attempts,
+                       created_at, started_at, finished_at
+                FROM etl.ingestion_jobs
+                WHERE id = %s
+                """,
+                (job_id,)
+            )
+            job = cur.fetchone()
+        self.conn.commit()
+        return dict(job) if job is not None else None
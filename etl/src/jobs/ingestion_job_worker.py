@@ -0,0 +1,159 @@
+import threading
+import traceback
+import etl.src.util.env as env
+
+from datetime import datetime
+from etl.src.datasets import DATASETS
+from etl.src.extract.location_code_cache import get_location_code_cache
+from etl.src.ingest.dataset_lock import DATASET_LOCK_WAIT_SECONDS
+from etl.src.ingest.mdh_api_ingestor import MdhApiIngestor
+from etl.src.jobs.ingestion_job_queue import IngestionJobQueue, JOB_LEASE_SECONDS, SUCCEEDED, FAILED
+from etl.src.util.db import get_pool
+from etl.src.util.logger import logger
+
+# Number of jobs each server process runs at the same time
+JOB_WORKERS = env.optional_env_int("ETL_JOB_WORKERS", 1)
+# How often idle workers look for new jobs enqueued by other processes
+JOB_POLL_SECONDS = env.optional_env_int("ETL_JOB_POLL_SECONDS", 5)
+# Wait after an unexpected error of a worker, doubled on every consecutive one up to JOB_MAX_BACKOFF_SECONDS
+JOB_ERROR_BACKOFF_SECONDS = env.optional_env_int("ETL_JOB_ERROR_BACKOFF_SECONDS", 1)
+JOB_MAX_BACKOFF_SECONDS = env.optional_env_int("ETL_JOB_MAX_BACKOFF_SECONDS", 60)
+
+
+class IngestionJobWorker:
+    """Background threads that claim jobs from etl.ingestion_jobs and run them."""
+    def __init__(self, DB_URL, MDH_API_KEY, num_workers=JOB_WORKERS, poll_seconds=JOB_POLL_SECONDS):
+        self.DB_URL = DB_URL
+        self.MDH_API_KEY = MDH_API_KEY
+        self.num_workers = num_workers
+        self.poll_seconds = poll_seconds
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        self.threads = []
+        self.handlers = {
+            "ingest": self.run_ingest,
+            "backfill": self.run_backfill,
+            "compact": self.run_compact,
+        }
+
+    def start(self):
+        """Start the worker threads, etl.ingestion_jobs must have been created by the ETL schema migration."""
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self.run, name=f"ingestion-job-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Started {self.num_workers} ingestion job worker(s).")
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def num_alive(self):
+        return sum(thread.is_alive() for thread in self.threads)
+
+    def notify(self):
+        """Wake up an idle worker, e.g. right after a job was enqueued by this process."""
+        self.wakeup.set()
+
+    def claim(self):
+        with get_pool(self.DB_URL).connection() as conn:
+            return IngestionJobQueue(conn).claim()
+
+    def run(self):
+        """
+        Claim and run jobs until stopped. Errors, e.g. from the db while claiming or finishing a job,
+        are logged and retried after a backoff, they never end the thread. A job that could not be
+        finished is claimed again once its lease expires.
+        """
+        num_errors = 0
+        while not self.stopping.is_set():
+            try:
+                job = self.claim()
+                if job is None:
+                    self.wakeup.wait(self.poll_seconds)
+                    self.wakeup.clear()
+                else:
+                    self.run_job(job)
+                num_errors = 0
+            except Exception:
+                num_errors += 1
+                backoff = min(JOB_ERROR_BACKOFF_SECONDS * 2 ** (num_errors - 1), JOB_MAX_BACKOFF_SECONDS)
+                logger.exception(f"Error in ingestion job worker, retrying in {backoff}s.")
+                self.stopping.wait(backoff)
+
+    def keep_alive(self, job_id, done):
+        while not done.wait(JOB_LEASE_SECONDS / 3):
+            try:
+                with get_pool(self.DB_URL).connection() as conn:
+                    IngestionJobQueue(conn).heartbeat(job_id)
+            except Exception as e:
+                logger.warning(f"Error updating heartbeat of ingestion job {job_id}: {e}")
+
+    def run_job(self, job):
+        logger.info(f"Running {job['kind']} job {job['id']} (attempt {job['attempts']})...")
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self.keep_alive, args=(job["id"], done), daemon=True)
+        heartbeat.start()
+        try:
+            handler = self.handlers.get(job["kind"])
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            status, results = handler(job["params"])
+            error = None
+        except Exception as e:
+            traceback.print_exc()
+            status, results, error = FAILED, None, str(e)
+        finally:
+            done.set()
+            heartbeat.join()
+        with get_pool(self.DB_URL).connection() as conn:
+            IngestionJobQueue(conn).finish(job["id"], status, results, error)
+        logger.info(f"{job['kind'].capitalize()} job {job['id']} {status}.")
+
+    def run_ingest(self, params):
+        datasets = params["datasets"]
+        location_code_mappings = None
+        if any(DATASETS[data_name].uses_location_codes for data_name in datasets):
+            location_code_mappings = get_location_code_cache(self.DB_URL, self.MDH_API_KEY).get_mappings()
+
+        results = {}
+        # A triggered ingestion waits for a run of the same dataset elsewhere to finish, then fetches what is new since
+        ingest_results = MdhApiIngestor.ingest_all(
+            self.DB_URL, self.MDH_API_KEY, datasets, location_code_mappings, lock_wait_seconds=DATASET_LOCK_WAIT_SECONDS
+        )
+        for data_name, (num_rows_inserted, err, metrics) in ingest_results.items():
+            if err is None:
+                results[data_name] = {"status": metrics.status, "data_window_hours": datasets[data_name], "rows_inserted": num_rows_inserted}
+            else:
+                results[data_name] = {"status": "error", "error": str(err)}
+            results[data_name]["metrics"] = metrics.as_dict()
+        status = SUCCEEDED if all(r["status"] in ("success", "skipped") for r in results.values()) else FAILED
+        return status, results
+
+    def run_backfill(self, params):
+        datasets = params["datasets"]
+        location_code_mappings = None
+        if any(DATASETS[data_name].uses_location_codes for data_name in datasets):
+            location_code_mappings = get_location_code_cache(self.DB_URL, self.MDH_API_KEY).get_mappings()
+
+        results = MdhApiIngestor.backfill(
+            self.DB_URL, self.MDH_API_KEY, datasets,
+            datetime.fromisoformat(params["start"]), datetime.fromisoformat(params["end"]),
+            location_code_mappings, params.get("chunk_hours"), params.get("max_concurrency")
+        )
+        status = SUCCEEDED if not any(summary["failed"] for summary in results.values()) else FAILED
+        return status, results
+
+    def run_compact(self, params):
+        results = {}
+        for data_name in params["datasets"]:
+            try:
+                removed = MdhApiIngestor.compact_raw(self.DB_URL, data_name, params["retention_days"], params["archive"])
+                results[data_name] = {"status": "success", "partitions_removed": removed}
+            except Exception as e:
+                results[data_name] = {"status": "error", "error": str(e)}
+        status = SUCCEEDED if all(r["status"] == "success" for r in results.values()) else FAILED
+        return status, results
@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+import etl.src.util.env as env
+
+from etl.src.datasets import DATASETS
+from etl.src.export.parquet_exporter import EXPORT_URI
+from etl.src.extract.location_code_cache import get_location_code_cache
+from etl.src.ingest.mdh_api_ingestor import MdhApiIngestor
+from etl.src.init_db.raw_partition_manager import RAW_RETENTION_DAYS
+from etl.src.util.logger import logger
+
+# Minutes between two ingestions of a dataset, overridable per dataset with ETL_SCHEDULE_MINUTES_<DATASET NAME>
+SCHEDULE_MINUTES = env.optional_env_int("ETL_SCHEDULE_MINUTES", 60)
+# Up to this many seconds of random delay added to every run, so datasets do not all hit MDH at once
+SCHEDULE_JITTER_SECONDS = env.optional_env_int("ETL_SCHEDULE_JITTER_SECONDS", 60)
+# Minutes between two compactions of the raw tables, 0 to not compact from the scheduler
+COMPACT_SCHEDULE_MINUTES = env.optional_env_int("ETL_COMPACT_SCHEDULE_MINUTES", 24 * 60)
+# Minutes between two Parquet exports of the datasets when ETL_EXPORT_URI is set, 0 to not export from the scheduler
+EXPORT_SCHEDULE_MINUTES = env.optional_env_int("ETL_EXPORT_SCHEDULE_MINUTES", 60)
+
+
+def schedule_minutes(data_name):
+    return env.optional_env_int(f"ETL_SCHEDULE_MINUTES_{data_name.upper()}", SCHEDULE_MINUTES)
+
+
+class IngestionScheduler:
+    """
+    Ingests every dataset on its own interval from one long-lived process, so the connection
+    pool, location code cache, HTTP session and schema version check are reused between runs.
+    Each dataset has its own thread: a run never overlaps the previous run of the same dataset,
+    one that takes longer than the interval delays the next run instead of piling up.
+    """
+    def __init__(self, DB_URL, MDH_API_KEY, datasets, intervals=None, jitter_seconds=SCHEDULE_JITTER_SECONDS,
+                 compact_minutes=COMPACT_SCHEDULE_MINUTES, export_minutes=EXPORT_SCHEDULE_MINUTES if EXPORT_URI else 0):
+        self.DB_URL = DB_URL
+        self.MDH_API_KEY = MDH_API_KEY
+        self.datasets = list(datasets)
+        self.intervals = {data_name: (intervals or {}).get(data_name) or schedule_minutes(data_name) for data_name in self.datasets}
+        self.jitter_seconds = jitter_seconds
+        self.compact_minutes = compact_minutes
+        self.export_minutes = export_minutes
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def ingest(self, data_name):
+        try:
+            location_code_mappings = None
+            if DATASETS[data_name].uses_location_codes:
+                location_code_mappings = get_location_code_cache(self.DB_URL, self.MDH_API_KEY).get_mappings()
+            MdhApiIngestor.ingest(self.DB_URL, self.MDH_API_KEY, data_name, None, location_code_mappings)
+        except Exception as e:
+            # Already logged by the ingestion, the next run starts from the same high-water mark
+            logger.error(f"Scheduled ingestion of {data_name} failed: {e}")
+
+    def compact(self):
+        for data_name in self.datasets:
+            try:
+                MdhApiIngestor.compact_raw(self.DB_URL, data_name, RAW_RETENTION_DAYS)
+            except Exception as e:
+                logger.error(f"Scheduled compaction of {data_name} failed: {e}")
+        if self.export_minutes:
+            self.export(compact=True)
+
+    def export(self, compact=False):
+        for data_name in self.datasets:
+            try:
+                MdhApiIngestor.export(self.DB_URL, data_name, compact=compact)
+            except Exception as e:
+                logger.error(f"Scheduled export of {data_name} failed: {e}")
+
+    def run_every(self, name, interval_minutes, task):
+        interval_seconds = interval_minutes * 60
+        next_run = time.monotonic() + random.uniform(0, self.jitter_seconds)
+        while not self.stopping.wait(max(0.0, next_run - time.monotonic())):
+            started = time.monotonic()
+            task()
+            next_run = started + interval_seconds + random.uniform(0, self.jitter_seconds)
+            if next_run < time.monotonic():
+                logger.warning(f"Scheduled {name} took {time.monotonic() - started:.0f}s, longer than its {interval_minutes} minute interval.")
+                next_run = time.monotonic()
+
+    def start(self):
+        tasks = [(data_name, self.intervals[data_name], lambda data_name=data_name: self.ingest(data_name)) for data_name in self.datasets]
+        if self.compact_minutes:
+            tasks.append(("compaction", self.compact_minutes, self.compact))
+        if self.export_minutes:
+            tasks.append(("export", self.export_minutes, self.export))
+        for name, interval_minutes, task in tasks:
+            thread = threading.Thread(target=self.run_every, args=(name, interval_minutes, task), name=f"scheduler-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Scheduled {', '.join(f'{name} every {interval_minutes}m' for name, interval_minutes, _ in tasks)}, with up to {self.jitter_seconds}s of jitter.")
+
+    def stop(self, timeout=None):
+        """Stop scheduling new runs and wait for the runs in progress to finish."""
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def run_forever(self):
+        self.start()
+        try:
+            while not self.stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        logger.info("Stopping the scheduler, waiting for runs in progress...")
+        self.stop()
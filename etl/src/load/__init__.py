@@ -1,4 +1,3 @@
-from .mdh_data_loader import MdhDataLoader
-from .mdh_vessel_departures_loader import MdhVesselDeparturesLoader
-from .mdh_vessel_arrivals_loader import MdhVesselArrivalsLoader
-from .mdh_vessels_due_to_arrive_loader import MdhVesselsDueToArriveLoader
\ No newline at end of file
+from .change_feed import ChangeFeed
+from .mdh_data_loader import LIVE_SCHEMA, MdhDataLoader
+from .vessel_status import VesselStatus
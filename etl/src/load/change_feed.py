@@ -0,0 +1,71 @@
+import json
+import etl.src.util.env as env
+
+from psycopg2.extras import RealDictCursor
+
+# Channel notified with {"data_name", "seq", "count"} when a load appends to etl.changes, for clients that LISTEN
+# to it to know when to read the changes after their last seq instead of polling
+CHANGE_FEED_CHANNEL = "etl_changes"
+# Max number of changes returned by one read
+CHANGE_FEED_PAGE_SIZE = env.optional_env_int("ETL_CHANGE_FEED_PAGE_SIZE", 1000)
+# Changes older than this are removed when raw data is compacted, unless the dataset's export has not written them yet
+CHANGE_FEED_RETENTION_DAYS = env.optional_env_int("ETL_CHANGE_FEED_RETENTION_DAYS", 7)
+
+
+class ChangeFeed:
+    """
+    Append-only etl.changes: every row inserted into a final table, in the order of its seq.
+    Consumers remember the last seq they have read and only fetch the changes after it.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def lock_for_append(self):
+        """
+        Serialize appends until the end of the current transaction, so changes are committed in
+        seq order and a reader never skips a seq that commits after a higher one it has read.
+        """
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('etl_changes'))")
+
+    def notify(self, data_name, seq, count):
+        """Tell listeners about the appended changes, delivered when the transaction commits."""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT pg_notify(%s, %s)",
+                (CHANGE_FEED_CHANNEL, json.dumps({"data_name": data_name, "seq": seq, "count": count}))
+            )
+
+    def read(self, after_seq=0, data_names=None, limit=CHANGE_FEED_PAGE_SIZE):
+        """Changes with a seq greater than after_seq, of data_names if given, oldest first."""
+        with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT seq, data_name, op, row_data, created_at
+                FROM etl.changes
+                WHERE seq > %(after_seq)s
+                AND (%(data_names)s::text[] IS NULL OR data_name = ANY(%(data_names)s::text[]))
+                ORDER BY seq
+                LIMIT %(limit)s
+                """,
+                {"after_seq": after_seq, "data_names": list(data_names) if data_names else None, "limit": limit}
+            )
+            return cur.fetchall()
+
+    def last_seq(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT coalesce(max(seq), 0) FROM etl.changes")
+            return cur.fetchone()[0]
+
+    def prune(self, data_name, retention_days=CHANGE_FEED_RETENTION_DAYS):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM etl.changes
+                WHERE data_name = %(data_name)s
+                AND created_at < now() - make_interval(days => %(retention_days)s)
+                AND seq <= coalesce((SELECT last_seq FROM etl.exports WHERE data_name = %(data_name)s), seq)
+                """,
+                {"data_name": data_name, "retention_days": retention_days}
+            )
+            return cur.rowcount
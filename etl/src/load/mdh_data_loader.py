@@ -1,29 +1,128 @@
+from psycopg2 import sql
+from etl.src.load.change_feed import ChangeFeed
+from etl.src.load.vessel_status import VesselStatus
+from etl.src.util.logger import logger
+
+# Schema of the final tables, the only one whose loads feed etl.changes and etl.vessel_status
+LIVE_SCHEMA = "public"
+
 class MdhDataLoader:
-    def __init__(self, conn, data_name, column_names_for_insert, record_identifier_columns):
+    """
+    Loads the staging table into <schema>.<data_name> as described by the dataset's DatasetSpec.
+    Loads into a schema other than the live one, such as the shadow tables of a replay, only insert rows.
+    """
+    def __init__(self, conn, spec, schema=LIVE_SCHEMA):
         self.conn = conn
-        self.data_name = data_name
-        self.column_names_for_insert = column_names_for_insert
-        self.record_identifier_columns = record_identifier_columns
-    
-    def insert_distinct_not_exists(self):
+        self.spec = spec
+        self.data_name = spec.name
+        self.schema = schema
+        self.table = sql.Identifier(schema, spec.name).as_string(conn)
+        self.column_names_for_insert = spec.insert_columns
+        self.record_identifier_columns = spec.identifier_columns
+        # seq of the last change appended by this load, None if nothing was inserted
+        self.last_change_seq = None
+
+    @property
+    def unique_index_name(self):
+        return f"{self.data_name}_record_identifier_key"
+
+    def delete_duplicates(self):
         with self.conn.cursor() as cur:
             cur.execute(
                 f"""
-                INSERT INTO public.{self.data_name}({', '.join(self.column_names_for_insert)})
-                SELECT {', '.join(self.column_names_for_insert)} FROM (
-                    SELECT DISTINCT ON ({', '.join(self.record_identifier_columns)}) * FROM staging.{self.data_name}
-                ) t2
-                WHERE NOT EXISTS (
-                    SELECT 1
-                    FROM public.{self.data_name} t1
-                    WHERE {' AND '.join(f"t1.{col} = t2.{col}" for col in self.record_identifier_columns)}
-                )
-                ORDER BY {self.record_identifier_columns[-1]} ASC
+                DELETE FROM {self.table} t1
+                USING {self.table} t2
+                WHERE t1.ctid > t2.ctid
+                AND {' AND '.join(f"t1.{col} = t2.{col}" for col in self.record_identifier_columns)}
                 """
             )
             return cur.rowcount
-        
-        
+
+    def ensure_unique_index(self):
+        """
+        Make sure <schema>.<data_name> has a unique index on the record identifier columns,
+        removing any duplicate records left behind by earlier loads before creating it.
+        Runs as part of the schema migration, with schema changes locked, never during a load.
+        Returns False if the table does not exist yet.
+        """
+        with self.conn.cursor() as cur:
+            index_name = sql.Identifier(self.schema, self.unique_index_name).as_string(self.conn)
+            cur.execute("SELECT to_regclass(%s), to_regclass(%s)", (self.table, index_name))
+            table, index = cur.fetchone()
+            if table is None:
+                return False
+            if index is None:
+                num_rows_deleted = self.delete_duplicates()
+                cur.execute(
+                    f"""
+                    CREATE UNIQUE INDEX IF NOT EXISTS {self.unique_index_name}
+                    ON {self.table} ({', '.join(self.record_identifier_columns)})
+                    """
+                )
+                logger.info(f"Created unique index {self.unique_index_name} on {self.table}, removing {num_rows_deleted} duplicate row(s) first.")
+            return True
+
+    def load_statement(self):
+        """SQL and parameters of the statement loading the staging table, see insert_on_conflict_do_nothing and insert_only."""
+        columns = ', '.join(self.column_names_for_insert)
+        if self.schema != LIVE_SCHEMA:
+            return (
+                f"""
+                INSERT INTO {self.table}({columns})
+                SELECT {columns} FROM {self.spec.staging_table}
+                ON CONFLICT ({', '.join(self.record_identifier_columns)}) DO NOTHING
+                """,
+                None
+            )
+        vessel_status = f"statuses AS ({VesselStatus.upsert_sql(self.spec, 'inserted')})," if self.spec.status_columns else ""
+        return (
+            f"""
+            WITH inserted AS (
+                INSERT INTO {self.table}({columns})
+                SELECT {columns} FROM {self.spec.staging_table}
+                ORDER BY {self.spec.timestamp_column} ASC
+                ON CONFLICT ({', '.join(self.record_identifier_columns)}) DO NOTHING
+                RETURNING *
+            ), {vessel_status}
+            changes AS (
+                INSERT INTO etl.changes (data_name, op, row_data)
+                SELECT %s, 'insert', to_jsonb(inserted) FROM inserted
+                ORDER BY inserted.{self.spec.timestamp_column} ASC
+                RETURNING seq
+            )
+            SELECT count(*), max(seq) FROM changes
+            """,
+            (self.data_name,)
+        )
+
+    def insert_on_conflict_do_nothing(self):
+        """
+        Insert the staged rows missing from the final table, then append the inserted rows to
+        etl.changes and update etl.vessel_status from them in the same statement.
+        Returns the number of rows inserted.
+        """
+        change_feed = ChangeFeed(self.conn)
+        change_feed.lock_for_append()
+        with self.conn.cursor() as cur:
+            cur.execute(*self.load_statement())
+            num_rows_inserted, self.last_change_seq = cur.fetchone()
+        if num_rows_inserted:
+            change_feed.notify(self.data_name, self.last_change_seq, num_rows_inserted)
+        return num_rows_inserted
+
+    def max_staged_event_time(self):
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT max({self.spec.timestamp_column}) FROM {self.spec.staging_table}")
+            return cur.fetchone()[0]
+
+    def insert_only(self):
+        """Insert the staged rows missing from the table. Returns the number of rows inserted."""
+        with self.conn.cursor() as cur:
+            cur.execute(*self.load_statement())
+            return cur.rowcount
+
     def load(self):
-        num_rows_inserted = self.insert_distinct_not_exists()
-        return num_rows_inserted
\ No newline at end of file
+        if self.schema != LIVE_SCHEMA:
+            return self.insert_only()
+        num_rows_inserted = self.insert_on_conflict_do_nothing()
+        return num_rows_inserted
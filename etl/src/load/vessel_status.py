@@ -0,0 +1,91 @@
+from etl.src.datasets import DATASETS
+from etl.src.util.logger import logger
+
+# Column identifying a vessel, in etl.vessel_status and in every final table
+VESSEL_STATUS_KEY = "imo"
+
+
+def vessel_status_column_types():
+    """dict of {etl.vessel_status column: Postgres type}, from the status columns of every dataset."""
+    column_types = {}
+    for spec in DATASETS.values():
+        for column, status_column in spec.status_columns.items():
+            column_types.setdefault(status_column, spec.column_types[column])
+    return column_types
+
+
+def vessel_status_indexed_columns():
+    """Status columns of every dataset's event time and locations, for time range and location lookups."""
+    indexed = []
+    for spec in DATASETS.values():
+        for column in [spec.timestamp_column, *spec.location_columns]:
+            status_column = spec.status_columns.get(column)
+            if status_column and status_column not in indexed:
+                indexed.append(status_column)
+    return indexed
+
+
+class VesselStatus:
+    """
+    etl.vessel_status: one row per IMO number with the latest arrival, departure and due to
+    arrive of the vessel, kept up to date from the rows each load inserts into the final tables.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def init_table(self):
+        # Columns are added one by one, so datasets gaining status columns extend the existing table
+        columns = "\n".join(
+            f"ALTER TABLE etl.vessel_status ADD COLUMN IF NOT EXISTS {column} {column_type};"
+            for column, column_type in vessel_status_column_types().items()
+        )
+        indexes = "\n".join(
+            f"CREATE INDEX IF NOT EXISTS vessel_status_{column}_idx ON etl.vessel_status ({column});"
+            for column in vessel_status_indexed_columns()
+        )
+        with self.conn.cursor() as cur:
+            cur.execute(
+                f"""
+                CREATE SCHEMA IF NOT EXISTS etl;
+                CREATE TABLE IF NOT EXISTS etl.vessel_status
+                (
+                    {VESSEL_STATUS_KEY} text COLLATE pg_catalog."default" PRIMARY KEY,
+                    updated_at timestamp with time zone NOT NULL DEFAULT now()
+                );
+                {columns}
+                {indexes}
+                """
+            )
+
+    def upsert_sql(spec, source):
+        """
+        Statement updating the vessels of source (rows of spec's final table) with their latest
+        row, unless the vessel already has a later one. Used as is or as a CTE over inserted rows.
+        """
+        columns = list(spec.status_columns)
+        status_columns = list(spec.status_columns.values())
+        order_status_column = spec.status_columns[spec.status_order_column]
+        return f"""
+            INSERT INTO etl.vessel_status ({VESSEL_STATUS_KEY}, {', '.join(status_columns)}, updated_at)
+            SELECT DISTINCT ON ({VESSEL_STATUS_KEY}) {VESSEL_STATUS_KEY}, {', '.join(columns)}, now()
+            FROM {source}
+            WHERE {VESSEL_STATUS_KEY} IS NOT NULL AND {spec.status_order_column} IS NOT NULL
+            ORDER BY {VESSEL_STATUS_KEY}, {spec.status_order_column} DESC, {spec.timestamp_column} ASC
+            ON CONFLICT ({VESSEL_STATUS_KEY}) DO UPDATE SET
+                {', '.join(f"{column} = EXCLUDED.{column}" for column in status_columns)},
+                updated_at = now()
+            WHERE etl.vessel_status.{order_status_column} IS NULL
+            OR EXCLUDED.{order_status_column} >= etl.vessel_status.{order_status_column}
+            """
+
+    def rebuild(self, spec):
+        """Update the status of every vessel from the whole final table of spec, if it exists yet."""
+        if not spec.status_columns:
+            return 0
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s)", (f"public.{spec.name}",))
+            if cur.fetchone()[0] is None:
+                return 0
+            cur.execute(VesselStatus.upsert_sql(spec, f"public.{spec.name}"))
+            logger.info(f"Updated the status of {cur.rowcount} vessel(s) from public.{spec.name}.")
+            return cur.rowcount
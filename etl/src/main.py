@@ -1,69 +1,280 @@
 import argparse
+import json
+import signal
+import sys
 import etl.src.util.env as env
-import requests
-import traceback
 
+from etl.src.datasets import DATASETS
+from etl.src.extract.location_code_cache import get_location_code_cache
+from etl.src.init_db.raw_partition_manager import RAW_RETENTION_DAYS
 from etl.src.ingest.mdh_api_ingestor import MdhApiIngestor
+from etl.src.ingest.replay_runner import validate_shadow_schema
+from etl.src.jobs.ingestion_scheduler import IngestionScheduler
+from datetime import datetime
+from etl.src.util.db import close_pools
 from loguru import logger
 
 
-def fetch_location_codes(MDH_API_KEY):
-    try:
-        endpoint = "https://sg-mdh-api.mpa.gov.sg/v1/mdhvessel/reference/locations/filetype/json"
-        r = requests.get(endpoint, headers={"apikey": MDH_API_KEY}, allow_redirects=True, timeout=10)
-        r.raise_for_status
-        location_header = r.headers.get('Location')
-    except Exception as e:
-        traceback.print_exc()
-        raise Exception(f'Data fetch for location_codes resource location failed: "{e}".')
-    
-    try:
-        r = requests.get(location_header)
-        return r.json()
-    except Exception as e:
-        traceback.print_exc()
-        raise Exception(f'Data fetch for location_codes data failed: "{e}".')
+def main(DB_URL, MDH_API_KEY, datasets, max_concurrency=None):
+    location_code_mappings = None
+    if any(DATASETS[data_name].uses_location_codes for data_name in datasets):
+        location_code_mappings = get_location_code_cache(DB_URL, MDH_API_KEY).get_mappings()
+    results = MdhApiIngestor.ingest_all(DB_URL, MDH_API_KEY, datasets, location_code_mappings, max_concurrency)
+    summary = [metrics.as_dict() for _, _, metrics in results.values()]
+    print(json.dumps({"runs": summary}, indent=2))
+    failed = [data_name for data_name, (_, err, _) in results.items() if err is not None]
+    if failed:
+        raise Exception(f"Ingestion failed for dataset(s): {failed}.")
 
-def main(DB_URL, MDH_API_KEY, datasets):
+def backfill(DB_URL, MDH_API_KEY, datasets, start, end, chunk_hours=None, max_concurrency=None):
     location_code_mappings = None
-    if any(item in datasets for item in ["vessels_due_to_arrive", "vessel_arrivals"]):
-        logger.info(f"Fetching latest location code values...")
-        location_codes_json = fetch_location_codes(MDH_API_KEY)
-        location_code_mappings = {entry['locationDescription']: entry['locationCode'] for entry in location_codes_json}
-        logger.info(f"Data fetched for location code values: {len(location_codes_json)} entries.")
-    for data_name, data_window_hours in datasets.items():
-        MdhApiIngestor.ingest(DB_URL, MDH_API_KEY, data_name, data_window_hours, location_code_mappings)
+    if any(DATASETS[data_name].uses_location_codes for data_name in datasets):
+        location_code_mappings = get_location_code_cache(DB_URL, MDH_API_KEY).get_mappings()
+    results = MdhApiIngestor.backfill(DB_URL, MDH_API_KEY, datasets, start, end, location_code_mappings, chunk_hours, max_concurrency)
+    print(json.dumps({"backfills": list(results.values())}, indent=2))
+    failed = [data_name for data_name, summary in results.items() if summary["failed"]]
+    if failed:
+        raise Exception(f"Backfill failed for chunk(s) of dataset(s): {failed}, run it again to retry them.")
+
+def parse_backfill_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="etl.src.main backfill",
+        description="Load history of datasets between two dates in chunks, resuming from the chunks already loaded"
+    )
+    parser.add_argument("datasets", nargs="+", help="Dataset names, e.g. vessel_arrivals")
+    parser.add_argument("--start", required=True, type=datetime.fromisoformat, help="Start of the range (SGT), e.g. 2025-01-01")
+    parser.add_argument("--end", required=True, type=datetime.fromisoformat, help="End of the range (SGT), e.g. 2025-03-01T12:00")
+    parser.add_argument(
+        "--chunk-hours",
+        type=int,
+        default=None,
+        help="Hours of data fetched per request (default: ETL_BACKFILL_CHUNK_HOURS or 24)"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="Max number of chunks fetched concurrently (default: ETL_BACKFILL_MAX_CONCURRENCY or 4)"
+    )
+    args = parser.parse_args(argv)
+    for name in args.datasets:
+        if name not in DATASETS:
+            raise Exception(f'Invalid dataset name: "{name}".')
+    return args
+
+def replay(DB_URL, MDH_API_KEY, datasets, start, end, shadow_schema=None, chunk_hours=None, max_concurrency=None,
+           reset_shadow=False):
+    location_code_mappings = None
+    if any(DATASETS[data_name].uses_location_codes for data_name in datasets):
+        location_code_mappings = get_location_code_cache(DB_URL, MDH_API_KEY).get_mappings()
+    results = MdhApiIngestor.replay(DB_URL, datasets, start, end, location_code_mappings, shadow_schema, chunk_hours,
+                                   max_concurrency, reset_shadow)
+    print(json.dumps({"replays": list(results.values())}, indent=2))
+    failed = [data_name for data_name, summary in results.items() if summary["failed"]]
+    if failed:
+        raise Exception(f"Replay failed for chunk(s) of dataset(s): {failed}.")
+
+def shadow_schema_arg(value):
+    try:
+        return validate_shadow_schema(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def parse_replay_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="etl.src.main replay",
+        description="Transform and load again the raw data fetched between two dates, without calling MDH. "
+                    "Into the final tables only rows missing from them are inserted, rows already loaded are "
+                    "never changed, so a live replay fills gaps but does not repair wrong rows: replay into "
+                    "--shadow-schema to find the rows that differ."
+    )
+    parser.add_argument("datasets", nargs="+", help="Dataset names, e.g. vessel_arrivals")
+    parser.add_argument("--start", required=True, type=datetime.fromisoformat, help="Start of the fetch time range (SGT), e.g. 2025-01-01")
+    parser.add_argument("--end", required=True, type=datetime.fromisoformat, help="End of the fetch time range (SGT), e.g. 2025-03-01T12:00")
+    parser.add_argument(
+        "--shadow-schema",
+        type=shadow_schema_arg,
+        default=None,
+        help="Load into <schema>.<dataset> tables, to compare with the final tables, instead of the final tables "
+             "(lowercase letters, digits and underscores)"
+    )
+    parser.add_argument(
+        "--reset-shadow",
+        action="store_true",
+        help="With --shadow-schema, drop the shadow tables first"
+    )
+    parser.add_argument(
+        "--chunk-hours",
+        type=int,
+        default=None,
+        help="Hours of fetch time replayed per chunk (default: ETL_REPLAY_CHUNK_HOURS or 24)"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="Max number of chunks replayed concurrently (default: ETL_REPLAY_MAX_CONCURRENCY or 4)"
+    )
+    args = parser.parse_args(argv)
+    for name in args.datasets:
+        if name not in DATASETS:
+            raise Exception(f'Invalid dataset name: "{name}".')
+    if args.reset_shadow and not args.shadow_schema:
+        parser.error("--reset-shadow requires --shadow-schema")
+    return args
+
+def export(DB_URL, datasets, uri=None, compact=False):
+    results = {}
+    failed = []
+    for data_name in datasets:
+        try:
+            results[data_name] = MdhApiIngestor.export(DB_URL, data_name, uri, compact)
+        except Exception:
+            failed.append(data_name)
+    print(json.dumps({"rows_exported": results}, indent=2))
+    if failed:
+        raise Exception(f"Export failed for dataset(s): {failed}.")
+
+def parse_export_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="etl.src.main export",
+        description="Write the rows loaded since the last export to date-partitioned Parquet files"
+    )
+    parser.add_argument("datasets", nargs="*", help="Dataset names, e.g. vessel_arrivals (default: all)")
+    parser.add_argument(
+        "--uri",
+        default=None,
+        help="Directory or s3:// uri to export to (default: ETL_EXPORT_URI)"
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Afterwards, merge the files of dates with at least ETL_EXPORT_COMPACT_MIN_FILES (default 8) files"
+    )
+    args = parser.parse_args(argv)
+    for name in args.datasets:
+        if name not in DATASETS:
+            raise Exception(f'Invalid dataset name: "{name}".')
+    args.datasets = args.datasets or list(DATASETS)
+    return args
+
+def daemon(DB_URL, MDH_API_KEY, datasets, interval_minutes=None):
+    intervals = {data_name: interval_minutes for data_name in datasets} if interval_minutes else None
+    scheduler = IngestionScheduler(DB_URL, MDH_API_KEY, datasets, intervals)
+    # Finish the runs in progress when the container is stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stopping.set())
+    scheduler.run_forever()
+
+def compact_raw(DB_URL, datasets, retention_days, archive):
+    failed = []
+    for data_name in datasets:
+        try:
+            MdhApiIngestor.compact_raw(DB_URL, data_name, retention_days, archive)
+        except Exception:
+            failed.append(data_name)
+    if failed:
+        raise Exception(f"Raw compaction failed for dataset(s): {failed}.")
 
 if __name__ == "__main__":
     DB_URL = env.require_env("DB_URL")
     MDH_API_KEY = env.require_env("MDH_API_KEY")
-    
-    DEFAULTS = {
-        "vessel_arrivals": 24,
-        "vessel_departures": 24,
-        "vessels_due_to_arrive": 73
-    }
-    
-    parser = argparse.ArgumentParser(description="Run ETL for datasets")
+
+    if sys.argv[1:2] == ["backfill"]:
+        args = parse_backfill_args(sys.argv[2:])
+        try:
+            backfill(DB_URL, MDH_API_KEY, args.datasets, args.start, args.end, args.chunk_hours, args.max_concurrency)
+        finally:
+            close_pools()
+        sys.exit(0)
+
+    if sys.argv[1:2] == ["replay"]:
+        args = parse_replay_args(sys.argv[2:])
+        try:
+            replay(DB_URL, MDH_API_KEY, args.datasets, args.start, args.end, args.shadow_schema, args.chunk_hours,
+                   args.max_concurrency, args.reset_shadow)
+        finally:
+            close_pools()
+        sys.exit(0)
+
+    if sys.argv[1:2] == ["export"]:
+        args = parse_export_args(sys.argv[2:])
+        try:
+            export(DB_URL, args.datasets, args.uri, args.compact)
+        finally:
+            close_pools()
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(
+        description="Run ETL for datasets",
+        epilog="To load history between two dates, see: python -m etl.src.main backfill --help. "
+               "To reprocess raw data already fetched, see: python -m etl.src.main replay --help. "
+               "To export to Parquet, see: python -m etl.src.main export --help"
+    )
     parser.add_argument(
         "datasets",
         nargs="*",
-        help="Dataset names, optionally with data_window_hours to fetch for, e.g. vessel_arrivals=24"
+        help="Dataset names, optionally with data_window_hours to fetch for, e.g. vessel_arrivals=24. "
+             "Without a window, only data since the last load is fetched (up to the default window)."
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="Max number of datasets ingested concurrently (default: ETL_MAX_CONCURRENCY or 3)"
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and ingest the datasets every ETL_SCHEDULE_MINUTES (default 60, "
+             "ETL_SCHEDULE_MINUTES_<DATASET NAME> per dataset), compacting raw data daily and exporting "
+             "to ETL_EXPORT_URI every ETL_EXPORT_SCHEDULE_MINUTES (default 60) if set"
+    )
+    parser.add_argument(
+        "--interval-minutes",
+        type=int,
+        default=None,
+        help="With --daemon, minutes between two ingestions of every dataset instead of ETL_SCHEDULE_MINUTES"
+    )
+    parser.add_argument(
+        "--compact-raw",
+        action="store_true",
+        help="Instead of ingesting, drop processed raw partitions older than --retention-days"
+    )
+    parser.add_argument(
+        "--retention-days",
+        type=int,
+        default=RAW_RETENTION_DAYS,
+        help="Days of raw data kept by --compact-raw (default: RAW_RETENTION_DAYS or 30)"
+    )
+    parser.add_argument(
+        "--archive",
+        action="store_true",
+        help="With --compact-raw, move old partitions to the raw_archive schema instead of dropping them"
     )
     args = parser.parse_args()
+    if args.daemon and any("=" in arg for arg in args.datasets):
+        parser.error("--daemon always fetches the data since the last load, data windows cannot be given")
 
     datasets = {}
     if not args.datasets:
-        datasets = DEFAULTS.copy()
+        datasets = {name: None for name in DATASETS}
     for arg in args.datasets:
         if "=" in arg:
             name, value = arg.split("=", 1)
-            if name not in DEFAULTS:
+            if name not in DATASETS:
                 raise Exception(f'Invalid dataset name: "{name}".')
             datasets[name] = int(value)
         else:
-            if arg not in DEFAULTS:
+            if arg not in DATASETS:
                 raise Exception(f'Invalid dataset name: "{arg}".')
-            datasets[arg] = DEFAULTS.get(arg, 1)
+            datasets[arg] = None
 
-    main(DB_URL, MDH_API_KEY, datasets)
\ No newline at end of file
+    try:
+        if args.daemon:
+            daemon(DB_URL, MDH_API_KEY, list(datasets), args.interval_minutes)
+        elif args.compact_raw:
+            compact_raw(DB_URL, datasets, args.retention_days, args.archive)
+        else:
+            main(DB_URL, MDH_API_KEY, datasets, args.max_concurrency)
+    finally:
+        close_pools()
\ No newline at end of file
@@ -1,79 +1,228 @@
 import etl.src.util.env as env
-import requests
 
-from fastapi import FastAPI, Header, Query, HTTPException
-from typing import Dict, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from fastapi import FastAPI, Header, Query, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Dict, List, Optional
+from etl.src.datasets import DATASETS
 from etl.src.ingest.mdh_api_ingestor import MdhApiIngestor
+from etl.src.init_db import EtlDbInitializer
+from etl.src.init_db.raw_partition_manager import RAW_RETENTION_DAYS
+from etl.src.jobs import IngestionJobQueue, IngestionJobWorker
+from etl.src.load.change_feed import CHANGE_FEED_PAGE_SIZE, ChangeFeed
+from etl.src.transform.mdh_data_transformer import SGT_UTC_OFFSET
+from etl.src.util.db import PoolTimeout, get_pool, close_pools
+from etl.src.util.metrics import MetricsRegistry
 from loguru import logger
 
-DEFAULT_DATASETS_WINDOWS = {
-    "vessel_arrivals": 24,
-    "vessel_departures": 24,
-    "vessels_due_to_arrive": 73
-}
-
 API_KEY_HEADER = "x-api-key"
 ETL_SERVICE_API_KEY = env.require_env("ETL_SERVICE_API_KEY")
 
 DB_URL = env.require_env("DB_URL")
 MDH_API_KEY = env.require_env("MDH_API_KEY")
 
+# Connections used by requests, in a pool of their own so requests never wait behind the job workers' ingestions
+API_DB_POOL_MAX_SIZE = env.optional_env_int("ETL_API_DB_POOL_MAX_SIZE", 3)
+# Seconds a request waits for one of them before answering 503, instead of holding a threadpool thread
+API_DB_TIMEOUT_SECONDS = env.optional_env_int("ETL_API_DB_TIMEOUT_SECONDS", 5)
+
+
+job_worker = IngestionJobWorker(DB_URL, MDH_API_KEY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared connection pool, check the schema version of every dataset and
+    # start the job workers once per worker process, ingestions then run no DDL
+    with get_pool(DB_URL).connection() as conn:
+        for data_name in DATASETS:
+            EtlDbInitializer(conn, data_name).init_etl_db()
+        conn.commit()
+    job_worker.start()
+    yield
+    job_worker.stop(timeout=10)
+    close_pools()
 
-app = FastAPI(title="Data Ingestion Service")
+app = FastAPI(title="Data Ingestion Service", lifespan=lifespan)
 
-@app.post("/trigger-ingestion")
+def api_connection():
+    return get_pool(DB_URL, "api", API_DB_POOL_MAX_SIZE).connection(API_DB_TIMEOUT_SECONDS)
+
+@app.exception_handler(PoolTimeout)
+async def pool_timeout(request: Request, e: PoolTimeout):
+    logger.warning(f"{request.method} {request.url.path} timed out waiting for a db connection.")
+    return JSONResponse(status_code=503, content={"detail": "Service busy, try again"}, headers={"Retry-After": "1"})
+
+@app.get("/health")
+async def health():
+    """
+    Liveness of the worker process. Answered on the event loop, without a db connection or a
+    threadpool thread, so it stays fast however busy requests and ingestions are. 503 when a job
+    worker thread has died, the process then no longer runs the jobs it should.
+    """
+    num_alive = job_worker.num_alive()
+    if num_alive < job_worker.num_workers:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "degraded", "job_workers": num_alive, "job_workers_expected": job_worker.num_workers}
+        )
+    return {"status": "ok", "job_workers": num_alive, "job_workers_expected": job_worker.num_workers}
+
+@app.post("/trigger-ingestion", status_code=202)
 def trigger_ingestion(
     datasets: Optional[Dict[str, Optional[int]]] = None,
     x_api_key: str = Header(None)
 ):
     """
-    Trigger ingestion for specified datasets and their respective data windows.
+    Enqueue ingestion for specified datasets and their respective data windows.
         datasets: dict of {dataset_name: data_window_hour}, window is optional.
-    If no dataset specified, trigger all with default window.
+    If no dataset specified, trigger all. Without a window, only data since the
+    last load is fetched (up to the dataset's default window).
+    Returns the job id to poll with GET /jobs/{job_id}, an identical job that is
+    still pending is reused instead of enqueueing a new one.
     """
     # Check API key
     if x_api_key != ETL_SERVICE_API_KEY:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     if not datasets:
-        selected = DEFAULT_DATASETS_WINDOWS
+        selected = {name: None for name in DATASETS}
     else:
         # Validate dataset names
-        invalid = [d for d in datasets.keys() if d not in DEFAULT_DATASETS_WINDOWS]
+        invalid = [d for d in datasets.keys() if d not in DATASETS]
         if invalid:
             raise HTTPException(status_code=400, detail=f"Invalid dataset(s): {invalid}")
-
-        # Apply provided data window or default if None
-        selected = {
-            name: (window if window is not None else DEFAULT_DATASETS_WINDOWS[name])
-            for name, window in datasets.items()
-        }
+        selected = datasets
     
-    # Fetch location codes data
-    location_code_mappings = None
-    if any(item in selected for item in ["vessels_due_to_arrive", "vessel_arrivals"]):
-        logger.info(f"Fetching latest location code values...")
-        try:
-            endpoint = "https://sg-mdh-api.mpa.gov.sg/v1/mdhvessel/reference/locations/filetype/json"
-            r = requests.get(endpoint, headers={"apikey": MDH_API_KEY}, allow_redirects=True, timeout=10)
-            r.raise_for_status
-            location_header = r.headers.get('Location')
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f'Data fetch for location_codes resource location failed: "{e}".')
-        try:
-            r = requests.get(location_header)
-            location_codes_json = r.json()
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=f'Data fetch for location_codes data failed: "{e}".')
-        location_code_mappings = {entry['locationDescription']: entry['locationCode'] for entry in location_codes_json}
-        logger.info(f"Data fetched for location code values: {len(location_codes_json)} entries.")
-
-    results = {}
-    for data_name, data_window_hours in selected.items():
-        try:
-            num_rows_inserted = MdhApiIngestor.ingest(DB_URL, MDH_API_KEY, data_name, data_window_hours, location_code_mappings)
-            results[data_name] = f"success (data_window_hours={data_window_hours}): {num_rows_inserted} new row(s) added."
-        except Exception as e:
-            results[data_name] = f"error: {str(e)}"
-
-    return {"triggered": list(selected.keys()), "results": results}
\ No newline at end of file
+    with api_connection() as conn:
+        job_id, created = IngestionJobQueue(conn).enqueue("ingest", {"datasets": selected})
+    job_worker.notify()
+    if created:
+        logger.info(f"Enqueued ingestion job {job_id} for {list(selected.keys())}.")
+
+    return {"job_id": job_id, "deduplicated": not created, "triggered": list(selected.keys())}
+
+@app.post("/backfill", status_code=202)
+def backfill(
+    datasets: List[str],
+    start: datetime,
+    end: datetime,
+    chunk_hours: Optional[int] = Query(None, ge=1),
+    max_concurrency: Optional[int] = Query(None, ge=1),
+    x_api_key: str = Header(None)
+):
+    """
+    Enqueue a backfill of the datasets between start and end (SGT), fetched in windows of
+    chunk_hours. Windows already loaded by an earlier backfill are skipped, so a failed or
+    interrupted backfill is resumed by triggering it again.
+        datasets: list of dataset names
+    Returns the job id to poll with GET /jobs/{job_id}.
+    """
+    if x_api_key != ETL_SERVICE_API_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    invalid = [d for d in datasets if d not in DATASETS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid dataset(s): {invalid}")
+    not_supported = [d for d in datasets if not DATASETS[d].incremental]
+    if not_supported:
+        raise HTTPException(status_code=400, detail=f"Backfill is not supported for dataset(s): {not_supported}")
+    # MDH windows are in SGT, times with an offset are converted, times without one are taken as SGT
+    start, end = [t.astimezone(timezone(SGT_UTC_OFFSET)).replace(tzinfo=None) if t.tzinfo else t for t in (start, end)]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    params = {
+        "datasets": datasets,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "chunk_hours": chunk_hours,
+        "max_concurrency": max_concurrency,
+    }
+    with api_connection() as conn:
+        job_id, created = IngestionJobQueue(conn).enqueue("backfill", params)
+    job_worker.notify()
+    if created:
+        logger.info(f"Enqueued backfill job {job_id} for {datasets} from {params['start']} to {params['end']}.")
+
+    return {"job_id": job_id, "deduplicated": not created, "triggered": datasets}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int, x_api_key: str = Header(None)):
+    """
+    Status of an ingestion job, with per-dataset row counts once it has finished.
+    """
+    if x_api_key != ETL_SERVICE_API_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    with api_connection() as conn:
+        job = IngestionJobQueue(conn).get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@app.get("/changes")
+def get_changes(
+    after_seq: int = Query(0, ge=0),
+    datasets: Optional[List[str]] = Query(None),
+    limit: int = Query(CHANGE_FEED_PAGE_SIZE, ge=1, le=CHANGE_FEED_PAGE_SIZE),
+    x_api_key: str = Header(None)
+):
+    """
+    Rows inserted into the final tables since after_seq, oldest first. Pass the returned
+    last_seq as after_seq of the next call to only get newer changes.
+        datasets: dataset names to filter on, all datasets if not specified.
+    """
+    if x_api_key != ETL_SERVICE_API_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    invalid = [d for d in datasets or [] if d not in DATASETS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid dataset(s): {invalid}")
+
+    with api_connection() as conn:
+        changes = ChangeFeed(conn).read(after_seq, datasets, limit)
+    return {
+        "changes": changes,
+        "last_seq": changes[-1]["seq"] if changes else after_seq,
+        "has_more": len(changes) == limit,
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Prometheus metrics of the ingestion runs executed by every process, read from etl.run_metrics.
+    Each worker returns the same totals, scrape a single one (e.g. through the service) rather
+    than each of them, or the sums are counted several times.
+    """
+    with api_connection() as conn:
+        return MetricsRegistry(conn).render()
+
+@app.post("/compact-raw", status_code=202)
+def compact_raw(
+    datasets: Optional[List[str]] = None,
+    retention_days: int = Query(RAW_RETENTION_DAYS, ge=0),
+    archive: bool = False,
+    x_api_key: str = Header(None)
+):
+    """
+    Enqueue dropping (or archiving) processed raw partitions older than retention_days.
+        datasets: list of dataset names, all datasets if not specified.
+    Returns the job id to poll with GET /jobs/{job_id}.
+    """
+    if x_api_key != ETL_SERVICE_API_KEY:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    selected = datasets or list(DATASETS)
+    invalid = [d for d in selected if d not in DATASETS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid dataset(s): {invalid}")
+
+    params = {"datasets": selected, "retention_days": retention_days, "archive": archive}
+    with api_connection() as conn:
+        job_id, created = IngestionJobQueue(conn).enqueue("compact", params)
+    job_worker.notify()
+    if created:
+        logger.info(f"Enqueued compaction job {job_id} for {selected} with retention_days={retention_days}.")
+
+    return {"job_id": job_id, "deduplicated": not created, "compacted": selected, "retention_days": retention_days}
\ No newline at end of file
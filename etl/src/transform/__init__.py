@@ -1,4 +1,2 @@
 from .mdh_data_transformer import MdhDataTransformer
-from .vessel_departures_transformer import VesselDeparturesTransformer
-from .vessel_arrivals_transformer import VesselArrivalsTransformer
-from .vessels_due_to_arrive_transformer import VesselsDueToArriveTransformer
+from .record_hash_store import RecordHashStore
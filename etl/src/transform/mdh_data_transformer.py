@@ -1,23 +1,86 @@
-import pytz
+import hashlib
+import ijson
+import psycopg2
+import io
+import time
+import uuid
+import weakref
+import etl.src.util.env as env
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from psycopg2 import extensions
+from etl.src.transform.record_hash_store import RecordHashStore
+from etl.src.util.binary_copy import JSONB_VERSION, BinaryCopyField, MemoryviewReader
 from etl.src.util.logger import logger
 
+# Number of records transformed together and streamed to staging per COPY statement
+STAGING_BATCH_SIZE = env.optional_env_int("ETL_STAGING_BATCH_SIZE", 10000)
+# Number of raw rows transformed and loaded per transaction when working through unprocessed rows
+RAW_BATCH_SIZE = env.optional_env_int("ETL_RAW_BATCH_SIZE", 10)
+
+# Staging tables created on each connection in a committed transaction, they last as long as the connection
+_staging_tables = weakref.WeakKeyDictionary()
+
+# Singapore has had a fixed UTC+8 offset since 1982, no tz database lookup is needed
+SGT_UTC_OFFSET = timedelta(hours=8)
+
+def sgt_to_utc(values):
+    """Convert a column of 'YYYY-MM-DD HH:MM:SS' SGT timestamps to aware UTC datetimes."""
+    parse = datetime.fromisoformat
+    utc = timezone.utc
+    return [(parse(value) - SGT_UTC_OFFSET).replace(tzinfo=utc) if value else None for value in values]
+
+# Characters with a meaning in COPY's text format, escaped in the values sent
+COPY_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def copy_text_value(value):
+    """A value in COPY's text format, where \\N is NULL and an empty field is the empty string."""
+    if value is None:
+        return "\\N"
+    return str(value).translate(COPY_TEXT_ESCAPES)
+
+def record_hash(values):
+    return hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).hexdigest()
+
 class MdhDataTransformer:
-    def __init__(self, conn, data_name, location_code_mappings):
+    """
+    Transforms raw MDH responses into the staging table as described by the dataset's DatasetSpec.
+    With skip_seen_records, records whose transformed values were already staged by an earlier
+    run are left out of staging, the load would skip them anyway. Without mark_processed, raw rows
+    are left as they are, for replays that do not load into the final table.
+    """
+    def __init__(self, conn, spec, location_code_mappings, staging_batch_size=None, skip_seen_records=True,
+                 raw_batch_size=None, mark_processed=True):
         self.conn = conn
-        self.data_name = data_name
-        self.tz = pytz.timezone("Asia/Singapore")
-        self.location_code_mappings = location_code_mappings
+        self.spec = spec
+        self.data_name = spec.name
+        self.location_code_mappings = location_code_mappings or {}
+        self.staging_batch_size = staging_batch_size or STAGING_BATCH_SIZE
+        self.raw_batch_size = raw_batch_size or RAW_BATCH_SIZE
+        self.skip_seen_records = skip_seen_records
+        self.mark_processed = mark_processed
+        self.record_hashes = RecordHashStore(conn, spec.name)
+        self.num_records_parsed = 0
+        self.num_records_seen = 0
+        self.staging_seconds = 0.0
     
     
-    def reset_staging_table(self):
+    def ensure_staging_table(self):
+        """
+        Create this connection's staging table unless it already exists. When no transaction is open
+        it is committed right away and not created again on this connection, a later rollback cannot
+        drop it. Its rows are deleted on every commit, so every transaction starts with it empty.
+        """
+        created = _staging_tables.setdefault(self.conn, set())
+        if self.spec.staging_table in created:
+            return
+        idle = self.conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE
         with self.conn.cursor() as cur:
-            cur.execute(
-                f"""
-                TRUNCATE staging.{self.data_name}
-                RESTART IDENTITY
-                """
-            )
-        
+            cur.execute(self.spec.staging_ddl)
+        if idle:
+            self.conn.commit()
+            created.add(self.spec.staging_table)
+
     def mark_raw_processed(self, ids):
         with self.conn.cursor() as cur:
             cur.execute(
@@ -28,48 +91,220 @@ class MdhDataTransformer:
                 """,
                 (ids,)
             )
-    def get_unprocessed_rows(self):
+    def get_unprocessed_rows(self, raw_ids=None):
         with self.conn.cursor() as cur:
             cur.execute(f"""
-                        SELECT id, fetched_at, response_json
+                        SELECT id, fetched_at
                         FROM raw.{self.data_name}
                         WHERE status_code=200
                         AND processed=false
+                        AND (%(raw_ids)s::bigint[] IS NULL OR id = ANY(%(raw_ids)s::bigint[]))
                         ORDER BY fetched_at DESC
-                        """)
+                        """,
+                        {"raw_ids": raw_ids})
             return cur.fetchall()
-    
-    def staging_transform_row(self, fetched_at, response_json):
-        raise NotImplementedError
-    
-    def staging_insert_item(self, item):
-        column_names = list(item.keys())
-        values = [item[column] for column in column_names]
-        with self.conn.cursor() as cur:
+
+    def close_held_cursor(self, cur):
+        """
+        Close a WITH HOLD cursor, which outlives rollbacks. psycopg2 does not close named cursors
+        in an aborted transaction, so that one is rolled back first, its work is lost anyway.
+        """
+        if cur.closed:
+            return
+        if self.conn.info.transaction_status == extensions.TRANSACTION_STATUS_INERROR:
+            self.conn.rollback()
+        try:
+            cur.close()
+        except psycopg2.Error:
+            # Never declared, the query opening it failed
+            self.conn.rollback()
+
+    def iter_raw_batches(self, cursor_name, condition, params=None):
+        """
+        Yield the successful raw rows matching condition as lists of (id, fetched_at) of at most
+        raw_batch_size rows, newest first, read through a server-side cursor that stays open across
+        the commits made between batches. The cursor is closed however iterating ends, it would
+        otherwise stay open on the pooled connection.
+        """
+        # Before the cursor opens a transaction, so the staging table is committed and created only once
+        self.ensure_staging_table()
+        cur = self.conn.cursor(f"{self.data_name}_{cursor_name}_{uuid.uuid4().hex}", withhold=True)
+        try:
+            cur.itersize = self.raw_batch_size
             cur.execute(
                 f"""
-                INSERT INTO staging.{self.data_name} ({', '.join(column_names)}                )
-                VALUES ({', '.join(['%s'] * len(column_names))})
+                SELECT id, fetched_at
+                FROM raw.{self.data_name}
+                WHERE status_code=200
+                AND {condition}
+                ORDER BY fetched_at DESC
                 """,
-                values
+                params
             )
-    
-    
-    def transform(self):
-        raw_rows = self.get_unprocessed_rows()
+            while True:
+                raw_rows = cur.fetchmany(self.raw_batch_size)
+                if not raw_rows:
+                    break
+                yield raw_rows
+        finally:
+            self.close_held_cursor(cur)
+
+    def iter_unprocessed_batches(self):
+        return self.iter_raw_batches("unprocessed", "processed=false")
+
+    def iter_fetched_batches(self, fetched_from, fetched_to):
+        """Batches of every raw row fetched in [fetched_from, fetched_to), processed or not."""
+        return self.iter_raw_batches(
+            "fetched",
+            "fetched_at >= %(fetched_from)s AND fetched_at < %(fetched_to)s",
+            {"fetched_from": fetched_from, "fetched_to": fetched_to}
+        )
+
+    def get_raw_payload(self, rid, fetched_at):
+        """
+        Return the stored response of a raw row as a file-like reader of its UTF-8 JSON, without
+        decoding it. A binary COPY sends the jsonb as its text once, where a bytea column would
+        arrive hex-encoded at twice the size and be decoded into yet another copy.
+        """
+        sink = BinaryCopyField()
+        with self.conn.cursor() as cur:
+            # fetched_at lets Postgres prune the lookup to a single raw partition
+            query = cur.mogrify(
+                f"""
+                SELECT response_json
+                FROM raw.{self.data_name}
+                WHERE id = %s
+                AND fetched_at = %s
+                """,
+                (rid, fetched_at)
+            ).decode("utf-8")
+            cur.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", sink)
+        jsonb = sink.value()
+        if jsonb is None:
+            return None
+        # Binary jsonb is a version byte followed by the JSON text
+        return MemoryviewReader(jsonb[len(JSONB_VERSION):])
+
+    def iter_records(self, payload):
+        """Incrementally parse the records of a JSON array payload."""
+        if payload is None:
+            return iter(())
+        return ijson.items(payload, "item")
+
+    def map_location_codes(self, column, values):
+        mappings = self.location_code_mappings
+        mapped = [mappings.get(value, value) for value in values]
+        num_mapped = sum(1 for value in values if value in mappings)
+        logger.debug(f"Shortened {num_mapped} long names to short names for '{column}'.")
+        return mapped
+
+    def transform_batch(self, fetched_at, records):
+        """
+        Transform a batch of records into staging columns in one pass per column.
+        Returns a dict of {staging_column: list of values}.
+        """
+        spec = self.spec
+        columns = {}
+        # Nested objects picked once per batch and shared by every field under them
+        parents = {(): records}
+        for column, keys in spec.field_keys.items():
+            for depth in range(1, len(keys)):
+                if keys[:depth] not in parents:
+                    parents[keys[:depth]] = [value[keys[depth - 1]] for value in parents[keys[:depth - 1]]]
+            values = parents[keys[:-1]]
+            if column == spec.timestamp_column:
+                # Records without an event time are kept, with a NULL time
+                columns[column] = sgt_to_utc([value.get(keys[-1]) for value in values])
+            else:
+                columns[column] = [value[keys[-1]] for value in values]
+        for column in spec.location_columns:
+            columns[column] = self.map_location_codes(column, columns[column])
+        columns["fetched_at"] = [fetched_at] * len(records)
+        return columns
+
+    def drop_seen_records(self, columns):
+        """Keep the first occurrence of every record not staged before, recording it as seen."""
+        hashes = [record_hash(values) for values in zip(*(columns[column] for column in self.spec.fields))]
+        new = self.record_hashes.add_new(hashes)
+        keep = []
+        for i, h in enumerate(hashes):
+            if h in new:
+                new.discard(h)
+                keep.append(i)
+        self.num_records_seen += len(hashes) - len(keep)
+        if len(keep) == len(hashes):
+            return columns
+        return {column: [values[i] for i in keep] for column, values in columns.items()}
+
+    def staging_copy_batch(self, column_names, batch):
+        buffer = io.StringIO()
+        buffer.writelines(
+            "\t".join([copy_text_value(value) for value in row]) + "\n"
+            for row in batch
+        )
+        buffer.seek(0)
+        start = time.perf_counter()
+        with self.conn.cursor() as cur:
+            cur.copy_expert(
+                f"""
+                COPY {self.spec.staging_table} ({', '.join(column_names)})
+                FROM STDIN
+                """,
+                buffer
+            )
+        self.staging_seconds += time.perf_counter() - start
+
+    def staging_copy_columns(self, columns):
+        """
+        Stream transformed columns into the staging table using COPY FROM STDIN.
+        Returns the number of rows staged.
+        """
+        column_names = list(columns.keys())
+        rows = list(zip(*columns.values()))
+        if rows:
+            self.staging_copy_batch(column_names, rows)
+        return len(rows)
+
+    def iter_record_batches(self, raw_rows):
+        """Yield (fetched_at, records) with at most staging_batch_size records at a time."""
+        for rid, fetched_at in raw_rows:
+            records = self.iter_records(self.get_raw_payload(rid, fetched_at))
+            while True:
+                batch = list(islice(records, self.staging_batch_size))
+                if not batch:
+                    break
+                yield fetched_at, batch
+
+    def transform_rows(self, raw_rows):
+        """
+        Transform the given raw rows, (id, fetched_at) pairs, into the staging table and mark them processed
+        if mark_processed.
+        Returns the number of rows staged.
+        """
+        self.ensure_staging_table()
+
+        start = time.perf_counter()
+        num_rows_staged = 0
+        for fetched_at, records in self.iter_record_batches(raw_rows):
+            self.num_records_parsed += len(records)
+            columns = self.transform_batch(fetched_at, records)
+            if self.skip_seen_records:
+                columns = self.drop_seen_records(columns)
+            num_rows_staged += self.staging_copy_columns(columns)
+        logger.debug(f"Transformed and staged {num_rows_staged} row(s) from {len(raw_rows)} raw row(s) for {self.data_name} in {time.perf_counter() - start:.3f}s, skipped {self.num_records_seen} record(s) already seen.")
+
+        if self.mark_processed:
+            self.mark_raw_processed([row[0] for row in raw_rows])
+        return num_rows_staged
+
+    def transform(self, raw_ids=None):
+        """
+        Transform unprocessed raw rows into the staging table, only those in raw_ids if given.
+        Returns the number of rows staged.
+        """
+        self.ensure_staging_table()
+        raw_rows = self.get_unprocessed_rows(raw_ids)
         if not raw_rows:
             logger.debug(f"There are no new api fetches to process for {self.data_name}.")
-            return
-
-        self.reset_staging_table()
-        
-        for rid, fetched_at, response_json in raw_rows:
-            items = self.staging_transform_row(fetched_at, response_json)
-            if not items:
-                continue
-            for item in items:
-                self.staging_insert_item(item)
-            
-        ids = [row[0] for row in raw_rows]
-        if ids:
-            self.mark_raw_processed(ids)
\ No newline at end of file
+            return 0
+        return self.transform_rows(raw_rows)
@@ -0,0 +1,62 @@
+import etl.src.util.env as env
+
+# Hashes first seen longer ago than this are removed when raw data is compacted, records only
+# come back while they are within a data window, which is much shorter
+RECORD_HASH_RETENTION_DAYS = env.optional_env_int("ETL_RECORD_HASH_RETENTION_DAYS", 7)
+# Namespace of the transaction-level advisory lock taken on a dataset before recording new hashes
+RECORD_HASH_LOCK_NAMESPACE = "etl_record_hashes"
+
+
+class RecordHashStore:
+    """Content hashes of the records already staged for a dataset, in etl.record_hashes."""
+    def __init__(self, conn, data_name):
+        self.conn = conn
+        self.data_name = data_name
+
+    def add_new(self, hashes):
+        """
+        Record the hashes (32 hex digits) not seen before and return them as a set. Recorded in the
+        current transaction, so they are forgotten again if the load that stages the records fails.
+        """
+        if not hashes:
+            return set()
+        with self.conn.cursor() as cur:
+            # Hashes are sent as a single string, which is far cheaper to send and parse than an array
+            # parameter. Looking them up first is cheaper than ON CONFLICT when most were seen before.
+            cur.execute(
+                """
+                SELECT replace(record_hash::text, '-', '') FROM etl.record_hashes
+                WHERE data_name = %s AND record_hash = ANY(string_to_array(%s, ',')::uuid[])
+                """,
+                (self.data_name, ",".join(hashes))
+            )
+            seen = {record_hash for (record_hash,) in cur.fetchall()}
+            unseen = {record_hash for record_hash in hashes if record_hash not in seen}
+            if not unseen:
+                return set()
+            # A transaction records hashes batch after batch, so concurrent runs sharing hashes, e.g. the
+            # chunks of a backfill, would take their row locks in different orders and deadlock. Runs of a
+            # dataset recording new hashes take turns instead, until the transaction ends.
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s), hashtext(%s))", (RECORD_HASH_LOCK_NAMESPACE, self.data_name))
+            cur.execute(
+                """
+                INSERT INTO etl.record_hashes (data_name, record_hash)
+                SELECT %s, unnest(string_to_array(%s, ',')::uuid[])
+                ON CONFLICT (data_name, record_hash) DO NOTHING
+                RETURNING replace(record_hash::text, '-', '')
+                """,
+                (self.data_name, ",".join(unseen))
+            )
+            return {record_hash for (record_hash,) in cur.fetchall()}
+
+    def prune(self, retention_days=RECORD_HASH_RETENTION_DAYS):
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE FROM etl.record_hashes
+                WHERE data_name = %s
+                AND first_seen_at < now() - make_interval(days => %s)
+                """,
+                (self.data_name, retention_days)
+            )
+            return cur.rowcount
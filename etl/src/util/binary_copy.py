@@ -0,0 +1,86 @@
+import struct
+
+# Header of COPY ... (FORMAT binary) data: signature, flags and header extension length
+COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_BINARY_TRAILER = struct.pack(">h", -1)
+# Version byte the binary representation of jsonb starts with, followed by the JSON text
+JSONB_VERSION = b"\x01"
+
+
+def text_field(value):
+    return value.encode("utf-8") if value is not None else None
+
+def int4_field(value):
+    return struct.pack(">i", value) if value is not None else None
+
+def bool_field(value):
+    return b"\x01" if value else b"\x00"
+
+def jsonb_field(json_bytes):
+    """Binary jsonb of UTF-8 JSON bytes, as a list of parts so the JSON itself is not copied."""
+    return [JSONB_VERSION, json_bytes] if json_bytes is not None else None
+
+
+class MemoryviewReader:
+    """File-like reader over a bytes-like object, read() copies out only the requested chunk."""
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = len(self.data) if size is None or size < 0 else min(self.pos + size, len(self.data))
+        chunk = bytes(self.data[self.pos:end])
+        self.pos = end
+        return chunk
+
+
+class BinaryCopyRow(MemoryviewReader):
+    """
+    File-like source for cursor.copy_expert(COPY ... FROM STDIN (FORMAT binary)) of a single row.
+    Fields are in the binary format of their column, None for NULL or a list of parts sent one
+    after the other, large values are read from in place rather than copied into one buffer.
+    """
+    def __init__(self, fields):
+        self.parts = [COPY_BINARY_HEADER, struct.pack(">h", len(fields))]
+        for field in fields:
+            if field is None:
+                self.parts.append(int4_field(-1))
+                continue
+            parts = field if isinstance(field, list) else [field]
+            self.parts.append(int4_field(sum(len(part) for part in parts)))
+            self.parts.extend(parts)
+        self.parts.append(COPY_BINARY_TRAILER)
+        self.next_part = 0
+        super().__init__(b"")
+
+    def read(self, size=-1):
+        while self.pos >= len(self.data) and self.next_part < len(self.parts):
+            self.data = memoryview(self.parts[self.next_part])
+            self.pos = 0
+            self.next_part += 1
+        return super().read(size)
+
+
+class BinaryCopyField:
+    """
+    File-like sink for cursor.copy_expert(COPY (SELECT <one column>) TO STDOUT (FORMAT binary))
+    of at most one row, keeping the data as received so the value is not copied again.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def value(self):
+        """memoryview of the value in its binary format, None if NULL or there is no row."""
+        data = memoryview(self.chunks[0] if len(self.chunks) == 1 else b"".join(self.chunks))
+        (extension_length,) = struct.unpack_from(">i", data, len(COPY_BINARY_HEADER) - 4)
+        pos = len(COPY_BINARY_HEADER) + extension_length
+        (num_fields,) = struct.unpack_from(">h", data, pos)
+        if num_fields == -1:
+            return None
+        (length,) = struct.unpack_from(">i", data, pos + 2)
+        if length == -1:
+            return None
+        return data[pos + 6:pos + 6 + length]
@@ -0,0 +1,158 @@
+import psycopg2
+import threading
+import time
+import etl.src.util.env as env
+
+from contextlib import contextmanager
+from psycopg2 import extensions
+from etl.src.util.logger import logger
+
+POOL_MIN_SIZE = env.optional_env_int("DB_POOL_MIN_SIZE", 1)
+POOL_MAX_SIZE = env.optional_env_int("DB_POOL_MAX_SIZE", 5)
+# Connections older than this are closed and replaced on checkout
+POOL_RECYCLE_SECONDS = env.optional_env_int("DB_POOL_RECYCLE_SECONDS", 1800)
+# Connections idle for longer than this are pinged before being handed out
+POOL_PING_IDLE_SECONDS = env.optional_env_int("DB_POOL_PING_IDLE_SECONDS", 30)
+
+
+class PoolTimeout(Exception):
+    """No connection of the pool became available in time."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections shared by every ingestion in the process.
+    Connections are opened on demand up to max_size and kept open while idle, checkouts block
+    when all of them are in use. Stale or broken connections are replaced transparently.
+    """
+    def __init__(self, DB_URL, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 recycle_seconds=POOL_RECYCLE_SECONDS, ping_idle_seconds=POOL_PING_IDLE_SECONDS):
+        self.DB_URL = DB_URL
+        self.max_size = max_size
+        self.recycle_seconds = recycle_seconds
+        self.ping_idle_seconds = ping_idle_seconds
+        self.available = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.closed = False
+        # Idle connections, the most recently used last
+        self.idle = []
+        # Open connections only, entries are removed when a connection is closed
+        self.created_at = {}
+        self.last_used_at = {}
+        for _ in range(min(min_size, max_size)):
+            self.idle.append(self.connect())
+
+    def connect(self):
+        conn = psycopg2.connect(self.DB_URL)
+        with self.lock:
+            self.created_at[conn] = time.monotonic()
+        return conn
+
+    def is_healthy(self, conn):
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            created_at = self.created_at.get(conn, now)
+            last_used_at = self.last_used_at.get(conn, now)
+        if now - created_at > self.recycle_seconds:
+            logger.debug(f"Recycling db connection older than {self.recycle_seconds}s.")
+            return False
+        if now - last_used_at > self.ping_idle_seconds:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error as e:
+                logger.warning(f"Discarding broken db connection: {e}")
+                return False
+        return True
+
+    def discard(self, conn):
+        with self.lock:
+            self.created_at.pop(conn, None)
+            self.last_used_at.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to timeout seconds (forever if None) for one to be available."""
+        if not self.available.acquire(timeout=timeout):
+            raise PoolTimeout(f"No db connection available after {timeout}s, all {self.max_size} are in use.")
+        try:
+            while True:
+                with self.lock:
+                    conn = self.idle.pop() if self.idle else None
+                if conn is None:
+                    return self.connect()
+                if self.is_healthy(conn):
+                    return conn
+                self.discard(conn)
+        except Exception:
+            self.available.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            if conn.closed or self.closed:
+                self.discard(conn)
+                return
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with self.lock:
+                self.last_used_at[conn] = time.monotonic()
+                self.idle.append(conn)
+        except psycopg2.Error:
+            self.discard(conn)
+        finally:
+            self.available.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def close(self):
+        """Close the idle connections, the ones checked out are closed when they are returned."""
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            self.discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(DB_URL, name="etl", max_size=None):
+    """
+    Return the process-wide connection pool for DB_URL, creating it on first use with max_size
+    connections (DB_POOL_MAX_SIZE by default). Pools of different names never share connections.
+    """
+    with _pools_lock:
+        pool = _pools.get((DB_URL, name))
+        if pool is None:
+            start = time.perf_counter()
+            pool = ConnectionPool(DB_URL, max_size=max_size or POOL_MAX_SIZE)
+            logger.debug(f"Opened {name} db connection pool (max_size={pool.max_size}) in {time.perf_counter() - start:.3f}s.")
+            _pools[(DB_URL, name)] = pool
+        return pool
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+def lock_schema_changes(conn):
+    """
+    Serialize DDL between concurrent ingestions until the end of the current transaction,
+    concurrent CREATE ... IF NOT EXISTS statements would otherwise race on the catalogs.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('etl_db_init'))")
@@ -7,3 +7,17 @@ def require_env(key: str) -> str:
         print(f"Error: environment variable {key} is required.", file=sys.stderr)
         sys.exit(1)
     return value
+
+def optional_env_int(key: str, default: int) -> int:
+    value = os.getenv(key)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Error: environment variable {key} must be an integer, got '{value}'.", file=sys.stderr)
+        sys.exit(1)
+
+def optional_env(key: str, default: str) -> str:
+    value = os.getenv(key)
+    return value if value else default
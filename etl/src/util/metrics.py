@@ -0,0 +1,119 @@
+import time
+
+from contextlib import contextmanager
+
+
+class RunMetrics:
+    """Stage timings and counters collected during one ingestion run of a dataset."""
+    def __init__(self, data_name):
+        self.data_name = data_name
+        self.status = None
+        self.stage_seconds = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_seconds(name, time.perf_counter() - start)
+
+    def add_stage_seconds(self, name, seconds):
+        self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+
+    def add(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + (value or 0)
+
+    def as_dict(self):
+        return {
+            "data_name": self.data_name,
+            "status": self.status,
+            "stage_seconds": {name: round(seconds, 4) for name, seconds in self.stage_seconds.items()},
+            **self.counters,
+        }
+
+
+class MetricsRegistry:
+    """
+    Totals of every recorded run in etl.run_metrics, rendered in the Prometheus text format.
+    Every process recording runs, server workers, the daemon and the CLI alike, adds to the same
+    totals, so scraping any one server worker returns the metrics of all of them.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def record_run(self, metrics):
+        # (kind, name, value) rows, in key order so concurrent runs lock the shared rows in the same order
+        rows = sorted(
+            [("runs", str(metrics.status), 1)]
+            + [("stage", stage, seconds) for stage, seconds in metrics.stage_seconds.items()]
+            + [("counter", name, value) for name, value in metrics.counters.items()]
+        )
+        kinds, names, values = (list(column) for column in zip(*rows))
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO etl.run_metrics AS m (data_name, kind, name, value, count)
+                SELECT %s, kind, name, value, 1
+                FROM unnest(%s::text[], %s::text[], %s::double precision[]) AS r(kind, name, value)
+                ON CONFLICT (data_name, kind, name) DO UPDATE
+                SET value = m.value + EXCLUDED.value, count = m.count + 1, updated_at = now()
+                """,
+                (metrics.data_name, kinds, names, values)
+            )
+        self.conn.commit()
+
+    def totals(self):
+        """Return {kind: [(data_name, name, value, count, updated_at)]} of every dataset."""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT kind, data_name, name, value, count, extract(epoch FROM updated_at)
+                FROM etl.run_metrics
+                ORDER BY kind, data_name, name
+                """
+            )
+            rows = cur.fetchall()
+        self.conn.rollback()
+        totals = {"runs": [], "stage": [], "counter": []}
+        for kind, *row in rows:
+            totals.setdefault(kind, []).append(tuple(row))
+        return totals
+
+    def render(self):
+        totals = self.totals()
+        lines = [
+            "# HELP etl_runs_total Ingestion runs by dataset and outcome.",
+            "# TYPE etl_runs_total counter",
+        ]
+        last_run_timestamp = {}
+        for data_name, status, _, count, updated_at in totals["runs"]:
+            lines.append(f'etl_runs_total{{dataset="{data_name}",status="{status}"}} {count}')
+            last_run_timestamp[data_name] = max(last_run_timestamp.get(data_name, 0), float(updated_at))
+
+        lines += [
+            "# HELP etl_stage_duration_seconds Time spent in each ingestion stage.",
+            "# TYPE etl_stage_duration_seconds summary",
+        ]
+        for data_name, stage, seconds, count, _ in totals["stage"]:
+            labels = f'dataset="{data_name}",stage="{stage}"'
+            lines.append(f"etl_stage_duration_seconds_sum{{{labels}}} {seconds:.6f}")
+            lines.append(f"etl_stage_duration_seconds_count{{{labels}}} {count}")
+
+        for name in sorted({name for _, name, _, _, _ in totals["counter"]}):
+            lines += [
+                f"# HELP etl_{name}_total Total {name.replace('_', ' ')} across ingestion runs.",
+                f"# TYPE etl_{name}_total counter",
+            ]
+            for data_name, counter, value, _, _ in totals["counter"]:
+                if counter == name:
+                    lines.append(f'etl_{name}_total{{dataset="{data_name}"}} {value:.0f}')
+
+        lines += [
+            "# HELP etl_last_run_timestamp_seconds Unix time the last ingestion run of a dataset finished.",
+            "# TYPE etl_last_run_timestamp_seconds gauge",
+        ]
+        for data_name, timestamp in sorted(last_run_timestamp.items()):
+            lines.append(f'etl_last_run_timestamp_seconds{{dataset="{data_name}"}} {timestamp:.3f}')
+        return "\n".join(lines) + "\n"